@@ -1,2 +1,25 @@
-from .titleNode import TitleNode
-from .titleManager import TitleManager
+# Submodules are only imported when one of their names is first used,
+# so that each elftai invocation pays only for what its command needs.
+_exports = {
+    'TitleNode': '.titleNode',
+    'TitleManager': '.titleManager',
+    'TitleServer': '.titleServer',
+    'Storage': '.storage',
+    'CsvStorage': '.csvStorage',
+    'SqliteStorage': '.sqliteStorage',
+    'Timings': '.timings',
+    'Renderer': '.renderer',
+    'Workspace': '.workspace',
+    'RecordReader': '.recordReader',
+    'History': '.history',
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    from importlib import import_module
+    value = getattr(import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,345 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+"""Benchmark of TitleManager operations over synthetic databases.
+Run it as:
+    python3 -m modules_elf.benchmark [-t TITLES] [-i ITEMS] ... [-o REPORT]
+
+A database with the requested shape is generated in a temporary directory,
+and the time taken by each operation is written as a JSON report."""
+
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from statistics import median
+
+from .titleManager import TitleManager
+from .csvStorage import CsvStorage
+from .history import History
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that a local 'elftai list' should not import, as its command doesn't need them
+_lazy_modules = ('termcolor', 'sqlite3', 'socket', 'json', 'shlex',
+                 'modules_elf.titleServer', 'modules_elf.sqliteStorage')
+
+def generate(path, titles, aliases, items, comments, pool=None, seed=0):
+    """Writes a synthetic database to the csv file 'path'.
+    Each of 'titles' Titles gets 'aliases' aliases, 'comments' comments and
+    'items' items. Items are drawn from a pool of 'pool' distinct items,
+    so that they repeat across Titles as they do in real databases.
+    Returns:
+        Tuple (names, items) with some titles and items present in the database."""
+    rnd = random.Random(seed)
+    if not pool:
+        pool = max(1, titles * items // 4)
+    some_names, some_items = [], []
+
+    with open(path, 'w', newline='') as fp:
+        wr = csv.writer(fp)
+        for t in range(titles):
+            title = "Title {:08d}".format(t)
+            title_row = [title] + ["t{}a{}".format(t, a) for a in range(aliases)]
+            node_items = set()
+            while len(node_items) < min(items, pool):
+                node_items.add("item{}".format(rnd.randrange(pool)))
+            node_items = list(node_items)
+            wr.writerows([
+                title_row,
+                ["Comment {} of {}".format(c, title) for c in range(comments)],
+                node_items,
+            ])
+            if rnd.random() < 0.1 or t < 10:
+                some_names.append(rnd.choice(title_row))
+                if node_items:
+                    some_items.append(rnd.choice(node_items))
+    return some_names, some_items
+
+def timed(func, *args):
+    """Runs func(*args). Returns the time it took, in seconds."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def per_call(func, args_list):
+    """Runs func(*args) for every 'args' in 'args_list'.
+    Returns a report entry with the average time per call."""
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed / max(1, len(args_list)), 'calls': len(args_list)}
+
+def once(func, *args, repeat=1):
+    """Runs func(*args) 'repeat' times.
+    Returns a report entry with the median time of a run."""
+    runs = [timed(func, *args) for _ in range(repeat)]
+    return {'seconds': median(runs), 'calls': repeat}
+
+def bench_manager(workdir, names, items, repeat):
+    """Times the public operations of TitleManager on the database in 'workdir'."""
+    csvname = os.path.join(workdir, 'database_elftai.csv')
+    journal = os.path.join(workdir, 'journal_elftai.csv')
+    index = os.path.join(workdir, 'index_elftai.csv')
+    results = {}
+
+    def load():
+        return TitleManager(CsvStorage(csvname, processes=1))
+    results['load'] = once(load, repeat=repeat)
+
+    def load_parallel():
+        storage = CsvStorage(csvname, processes=max(2, os.cpu_count() or 1))
+        storage.parallel_min = 0
+        return TitleManager(storage)
+    results['load_parallel'] = once(load_parallel, repeat=repeat)
+
+    TitleManager(CsvStorage(csvname, index=index)) # Builds the index
+    results['load_indexed'] = once(lambda: TitleManager(CsvStorage(csvname, index=index)), repeat=repeat)
+    tm = TitleManager(CsvStorage(csvname, index=index))
+    results['lookup_indexed'] = per_call(tm._find_node_byName, [(n,) for n in names])
+
+    tm = load()
+    results['_find_node_byName'] = per_call(tm._find_node_byName, [(n,) for n in names])
+    results['index_names'] = once(tm.find_similar, names[0])
+    results['find_prefix'] = per_call(tm.find_prefix, [(n[:len(n) // 2], 10) for n in names])
+    results['find_similar'] = per_call(tm.find_similar, [(n[:-2] + n[-1:], 10) for n in names])
+    results['add_item'] = per_call(tm.add_item, [(n, 'benchmark item') for n in names])
+    results['rm_item'] = per_call(tm.rm_item, [(n, 'benchmark item') for n in names])
+    results['find_item'] = per_call(tm.find_item, [(i,) for i in items])
+    new_titles = ["Benchmark Title {}".format(i) for i in range(len(names))]
+    results['add_node'] = per_call(tm.add_node, [(t,) for t in new_titles])
+    for title in new_titles:
+        tm.rm_node(title)
+
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+        results['print_summary'] = once(tm.print_summary, repeat=repeat)
+        results['print_full'] = once(tm.print_full, None, 5, repeat=repeat)
+        results['print_full_title'] = per_call(tm.print_full, [(n, 5) for n in names])
+
+    # Saving a single change, with and without a journal
+    tm = TitleManager(csvname, os.path.join(workdir, 'backup_elftai.csv'))
+    tm.add_item(names[0], 'benchmark item')
+    results['close'] = once(tm.close)
+    tm = TitleManager(csvname, journal=journal)
+    tm.rm_item(names[0], 'benchmark item')
+    results['close_journal'] = once(tm.close)
+    results['compact'] = once(tm.compact, repeat=repeat)
+    return results
+
+def _open(workdir, history=True):
+    """Returns a TitleManager of the database in 'workdir', as the writers of bench_writers() open it."""
+    storage = CsvStorage(os.path.join(workdir, 'database_elftai.csv'),
+                         journal=os.path.join(workdir, 'journal_elftai.csv'), journal_limit=1<<14)
+    return TitleManager(storage, history=History(os.path.join(workdir, 'history_elftai.csv'), None, None)
+                        if history else None)
+
+def _state(tm):
+    """Returns the contents of all Titles of 'tm', by title, to be compared."""
+    return {node.get_title(): (sorted(node.get_alias()), node.get_comment_list(), sorted(node.get_items()))
+            for node in tm.nodes}
+
+def _write_items(workdir, title, prefix, count):
+    """Adds 'count' items to 'title', and a comment every 5 items, saving after each one
+    as separate elftai invocations do. Each item is a command of its own in the History."""
+    for i in range(count):
+        tm = _open(workdir)
+        label = "{} {}".format(prefix, i)
+        tm.checkpoint(label)
+        tm.add_item(title, label)
+        if i % 5 == 0:
+            tm.add_comment(title, label)
+        tm.close()
+
+def _undo(workdir, count):
+    """Undoes the last command 'count' times, saving after each one.
+    Returns the number of commands undone."""
+    return sum(len(_open(workdir).undo(1)) for i in range(count))
+
+def bench_writers(workdir, names, writers, count):
+    """Times 'writers' processes adding 'count' items each, with comments, to the same Titles at once,
+    then as many processes undoing a fifth of those commands at once.
+    Returns a report entry with the number of items and comments lost, which must be 0,
+    the number of Titles that a TitleManager opened before the writers started, once
+    refreshed, holds differently from a new one, which must be 0 too, and under 'undo',
+    the number of undone items still there or kept items gone, which must be 0 as well."""
+    from concurrent.futures import ProcessPoolExecutor
+    watcher = _open(workdir, history=False)
+    report = {'calls': writers * count}
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(writers) as pool:
+        futures = [pool.submit(_write_items, workdir, names[w % len(names)], "writer {}".format(w), count)
+                   for w in range(writers)]
+        for future in futures:
+            future.result()
+    report['seconds'] = time.perf_counter() - start
+
+    tm = _open(workdir)
+    items = [item for node in tm.nodes for item in node.get_items() if item.startswith('writer ')]
+    comments = [comment for node in tm.nodes for comment in node.get_comment_list() if comment.startswith('writer ')]
+    report['lost'] = writers * count - len(set(items))
+    report['lost_comments'] = writers * len(range(0, count, 5)) - len(set(comments))
+    report['duplicated'] = len(items) - len(set(items)) + len(comments) - len(set(comments))
+    watcher.refresh()
+    seen, stored = _state(watcher), _state(tm)
+    report['stale'] = sum(1 for title in set(seen) | set(stored) if seen.get(title) != stored.get(title))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(writers) as pool:
+        undone = sum(pool.map(_undo, [workdir] * writers, [count // 5] * writers))
+    elapsed = time.perf_counter() - start
+    tm = _open(workdir)
+    kept = set(label for when, label, size in tm.get_history() if label.startswith('writer '))
+    items = set(item for node in tm.nodes for item in node.get_items() if item.startswith('writer '))
+    report['undo'] = {'seconds': elapsed, 'calls': writers * (count // 5), 'undone': undone,
+                      'inconsistent': len(kept ^ items) + abs(writers * count - undone - len(items))}
+    return report
+
+def install(workdir):
+    """Copies the program to 'workdir', so that it uses the database there.
+    Returns the command line that runs the copy."""
+    shutil.copy(os.path.join(_root, 'elftai'), workdir)
+    shutil.copytree(os.path.join(_root, 'modules_elf'), os.path.join(workdir, 'modules_elf'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    return [sys.executable, os.path.join(workdir, 'elftai')]
+
+def bench_startup(program, argv):
+    """Runs 'program' with arguments 'argv' under python's -X importtime, with output to a pipe.
+    Returns a report entry with the time spent importing modules, their number,
+    and which of _lazy_modules were imported anyway."""
+    subprocess.run(program + argv, stdout=subprocess.DEVNULL, check=True) # Writes the bytecode cache
+    proc = subprocess.run(program[:1] + ['-X', 'importtime'] + program[1:] + argv,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+    micros, modules = 0, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            micros += int(fields[0])
+        except ValueError:
+            continue # Header line
+        modules.append(fields[2].strip())
+    return {
+        'seconds': micros / 1e6,
+        'modules': len(modules),
+        'unexpected': [m for m in _lazy_modules if m in modules],
+    }
+
+def bench_cli(program, names, items, repeat):
+    """Times whole 'elftai' invocations of the command line 'program'."""
+    commands = {
+        'list': ['list'],
+        'list_title': ['list', names[0]],
+        'find': ['find', items[0]],
+        'add_item': ['add', '-t', names[0], '-i', 'benchmark cli item'],
+        'rm_item': ['rm', '-t', names[0], '-i', 'benchmark cli item'],
+    }
+
+    def run(argv):
+        subprocess.run(program + argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    results = {}
+    for name, argv in commands.items():
+        results[name] = once(run, argv, repeat=repeat)
+    return results
+
+def main(argv=None):
+    parser = ArgumentParser(description="Benchmark ElfTAI over a synthetic database.")
+    parser.add_argument('-t', '--titles', default=1000, type=int, help='Number of Titles')
+    parser.add_argument('-a', '--aliases', default=2, type=int, help='Number of aliases per Title')
+    parser.add_argument('-i', '--items', default=100, type=int, help='Number of items per Title')
+    parser.add_argument('-c', '--comments', default=1, type=int, help='Number of comments per Title')
+    parser.add_argument('-p', '--pool', default=None, type=int, help='Number of distinct items. Defaults to a quarter of all items.')
+    parser.add_argument('-r', '--repeat', default=3, type=int, help='Number of runs of whole-database operations')
+    parser.add_argument('-s', '--seed', default=0, type=int, help='Seed of the random generator')
+    parser.add_argument('-o', '--output', type=str, help='File to which write the report. Defaults to standard output.')
+    parser.add_argument('-w', '--writers', default=4, type=int, help='Number of processes saving items, then undoing, at once')
+    parser.add_argument('--no-cli', action='store_true', help='Skip timing whole elftai invocations')
+    parser.add_argument('--max-startup-ms', type=float, help='Exit with status 1 if elftai spends longer than this importing modules, or imports modules its command does not need')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='elftai-bench-')
+    try:
+        csvname = os.path.join(workdir, 'database_elftai.csv')
+        start = time.perf_counter()
+        names, items = generate(csvname, args.titles, args.aliases, args.items,
+                                args.comments, args.pool, args.seed)
+        report = {
+            'parameters': {
+                'titles': args.titles, 'aliases': args.aliases, 'items': args.items,
+                'comments': args.comments, 'pool': args.pool, 'repeat': args.repeat, 'seed': args.seed,
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+            },
+            'database': {
+                'bytes': os.path.getsize(csvname),
+                'generate_seconds': time.perf_counter() - start,
+            },
+            'manager': bench_manager(workdir, names, items, args.repeat),
+        }
+        if args.writers > 0:
+            report['writers'] = bench_writers(workdir, names, args.writers, 50)
+        if not args.no_cli or args.max_startup_ms is not None:
+            program = install(workdir)
+            report['startup'] = bench_startup(program, ['list', names[0]])
+        if not args.no_cli:
+            report['cli'] = bench_cli(program, names, items, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    writers = report.get('writers')
+    if writers:
+        failures = {name: writers[name] for name in ('lost', 'lost_comments', 'duplicated', 'stale') if writers[name]}
+        if writers['undo']['inconsistent']:
+            failures['inconsistent'] = writers['undo']['inconsistent']
+        if failures:
+            sys.exit("Concurrency regression: {}".format(
+                ', '.join('{} {}'.format(count, name) for name, count in failures.items())))
+
+    if args.max_startup_ms is not None:
+        startup = report['startup']
+        if startup['seconds'] * 1000 > args.max_startup_ms:
+            sys.exit("Startup regression: {:.1f} ms spent importing modules, more than {} ms".format(
+                startup['seconds'] * 1000, args.max_startup_ms))
+        if startup['unexpected']:
+            sys.exit("Startup regression: modules imported without need: {}".format(
+                ', '.join(startup['unexpected'])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+
+"""Terminal colors for ElfTAI output.
+termcolor is only imported once colored text is actually printed, and
+colors are left out when standard output isn't a terminal or when the
+NO_COLOR environment variable is set, so that output piped to other
+programs or files is plain text and cheap to produce."""
+
+import os
+import sys
+
+_enabled = None
+_colored = None
+
+def set_enabled(enabled):
+    """Forces colors on (True) or off (False).
+    None goes back to deciding by standard output and the environment."""
+    global _enabled
+    _enabled = enabled
+
+def is_enabled():
+    """Checks if colored() currently adds colors."""
+    global _enabled
+    if _enabled is None:
+        if 'NO_COLOR' in os.environ or 'ANSI_COLORS_DISABLED' in os.environ:
+            _enabled = False
+        else:
+            try:
+                _enabled = sys.stdout.isatty()
+            except (AttributeError, ValueError): # Replaced or closed stdout
+                _enabled = False
+    return _enabled
+
+def colored(text, color=None, attrs=None):
+    """Returns 'text' with the given color and attributes, as termcolor.colored() does,
+    or 'text' itself if colors are disabled."""
+    global _colored
+    if not is_enabled():
+        return text
+    if _colored is None:
+        from termcolor import colored as _colored
+    try:
+        # Newer termcolor versions check the terminal themselves, which fails
+        # when 'elftai serve' prints to a buffer on behalf of a terminal
+        return _colored(text, color, attrs=attrs, force_color=True)
+    except TypeError: # Older versions always add colors
+        return _colored(text, color, attrs=attrs)
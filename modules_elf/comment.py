@@ -26,8 +26,12 @@ class Comment:
         Exception: Any other exception is to be considered a fatal bug.
     """
 
+    __slots__ = ('comment', 'dirty')
+
     def __init__(self):
+        # dirty: whether comments changed since the last mark_clean()
         self.comment = []
+        self.dirty = False
 
     def __getitem__(self, idx):
         return self.get(idx)
@@ -46,6 +50,7 @@ class Comment:
             raise TypeError
         temp = self.comment[index]
         self.comment[index] = comment
+        self.dirty = True
         return temp
 
     def add(self, comment):
@@ -57,6 +62,7 @@ class Comment:
         and False not in [isinstance(i, str) for i in comment]:
             self.comment.extend(comment)
         else: raise TypeError
+        self.dirty = True
 
     def get(self, index):
         """Returns a comment from this Object."""
@@ -69,4 +75,14 @@ class Comment:
     def rm(self, index):
         """Removes comment of index 'index'.
         Returns the removed comment."""
-        return self.comment.pop(index)
+        retval = self.comment.pop(index)
+        self.dirty = True
+        return retval
+
+    def is_dirty(self):
+        """Checks if comments changed since the last call to mark_clean()."""
+        return self.dirty
+
+    def mark_clean(self):
+        """Marks the current comments as saved."""
+        self.dirty = False
@@ -0,0 +1,540 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import csv
+import io
+import locale
+import mmap
+import os
+import sys
+from bisect import bisect_left
+from hashlib import blake2b
+
+from .storage import Storage
+from .titleNode import TitleNode
+from .journal import Journal
+from .nodeIndex import NodeIndex
+
+# Encoding used by open() for the csv file, needed when it is read or written as bytes
+_encoding = locale.getpreferredencoding(False)
+
+def _fsync_dir(filename):
+    """Flushes to disk the directory entry of 'filename', so that renaming it survives a crash."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass # Not supported everywhere
+    finally:
+        os.close(fd)
+
+def _digest(block):
+    """Returns the hash by which the bytes 'block' of a Node's 3 csv rows are recognized."""
+    return blake2b(block, digest_size=16).digest()
+
+class _LineReader:
+    """Iterates over the lines of a file opened in binary mode, decoding them.
+    Keeps track of the byte offset of the next line to be read, so that it can
+    be handed to a csv.reader while recording where each row begins.
+    The undecoded lines read are kept in 'raw', if it is a list."""
+
+    def __init__(self, fp, raw=None):
+        self.fp = fp
+        self.offset = fp.tell()
+        self.raw = raw
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.fp.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        if self.raw is not None:
+            self.raw.append(line)
+        return line.decode(_encoding)
+
+def _next_row(data, pos):
+    """Returns the offset of the csv row after the one containing offset 'pos' of 'data',
+    which must not be inside a quoted field. Line breaks inside quoted fields don't end rows;
+    quotes within those fields are doubled, so quotes always come in pairs."""
+    while True:
+        nl = data.find(b'\n', pos)
+        if nl < 0:
+            return len(data)
+        q = data.find(b'"', pos, nl)
+        if q < 0:
+            return nl + 1
+        close = data.find(b'"', q + 1)
+        if close < 0:
+            return len(data)
+        pos = close + 1
+
+def _count_rows(data, pos, end):
+    """Counts the csv rows ending in data[pos:end], where 'pos' is not inside a quoted field.
+    Returns:
+        Pair (count, stop), where 'stop' is 'end', or the end of the quoted field 'end' is in."""
+    def count(start, stop, block=1<<24):
+        return sum(data[i:min(i + block, stop)].count(b'\n') for i in range(start, stop, block))
+
+    rows = 0
+    while True:
+        q = data.find(b'"', pos, end)
+        if q < 0:
+            return rows + count(pos, end), end
+        rows += count(pos, q)
+        close = data.find(b'"', q + 1)
+        if close < 0:
+            return rows, len(data)
+        pos = close + 1
+        if pos >= end:
+            return rows, pos
+
+def _parse_chunk(filename, start, end):
+    """Parses the Nodes between byte offsets 'start' and 'end' of the csv file 'filename'.
+    Runs in worker processes, so it returns plain data, cheap to send back.
+    Returns:
+        List of tuples (offset, digest, names, comments, items), where 'digest' is the _digest()
+        of the Node's rows and the last 3 are as taken by TitleNode.read_parsed()."""
+    with open(filename, 'rb') as fp:
+        fp.seek(start)
+        data = fp.read(end - start)
+    lines = _LineReader(io.BytesIO(data))
+    rd = csv.reader(lines)
+    nodes = []
+    while True:
+        offset = lines.offset
+        try:
+            names, comments, row = next(rd), next(rd), next(rd)
+        except StopIteration:
+            return nodes
+        items = {}
+        for i in row:
+            # Interned strings repeated across Nodes are sent only once
+            items.setdefault(sys.intern(i.lower()), sys.intern(i))
+        nodes.append((start + offset, _digest(data[offset:lines.offset]), names, comments, items))
+
+class CsvStorage(Storage):
+    """Storage that keeps all Nodes in a csv file, in the format described in README.md.
+
+    If a journal file is given, operations are appended to it instead of
+    rewriting the csv file on every save. The journal is replayed on load,
+    and folded into the csv file by write_all(). Should write_all() be
+    interrupted after setting the journal aside, the next CsvStorage opened
+    on the same files finishes replacing the csv file.
+
+    If an index file is given and matches the csv file, Nodes can be read
+    one at a time, by seeking to their offset in the csv file.
+
+    Csv files of at least 'parallel_min' bytes are read by 'processes'
+    worker processes, each parsing a chunk of the file. Chunks are split
+    where Nodes begin, as told by the index or found by scanning the file.
+
+    Changes made to the files by others are found by refresh(). The csv file
+    changed if its size, modification time or inode did; then only Nodes whose
+    rows hash differently from when they were read are parsed again.
+
+    Saving takes an exclusive lock on a file named after the csv file, with
+    '.lock' appended, so that processes saving at once don't mix their records
+    in the journal or overwrite each other's csv file. Where file locks are not
+    available, saving is not locked.
+
+    Exceptions:
+        TypeError - When any argument received has invalid type.
+    """
+
+    # Size of csv file, in bytes, from which it is read in parallel
+    parallel_min = 16 << 20
+
+    def __init__(self, filename, bkfile=None, journal=None, journal_limit=1<<20, index=None, processes=None):
+        # filename: name of file from which to read all nodes
+        # bkfile: name of file to which backup all nodes
+        # journal: Journal of operations not yet written to 'filename', if any
+        # index: NodeIndex of 'filename', if any
+        # offsets: maps normalized names to offsets of nodes, if the index matches 'filename'
+        # fp: 'filename' opened in binary mode while 'offsets' is in use. Nodes are read from it,
+        #     as it stays the file indexed even if 'filename' is replaced meanwhile.
+        # seen: maps offsets of nodes returned by read() to the nodes returned
+        # processes: number of processes reading a large csv file. Defaults to the number of CPUs.
+        # stamp: _stat() of 'filename' when nodes were last read from it or written to it
+        # blocks: maps the _digest() of the rows of each node read or written to the node
+        # journal_size: size of the journal when its records were last read or appended, or None if unknown
+        # locked: whether this process holds the lock of 'filename'
+        if not isinstance(filename, str):
+            raise TypeError
+        self.filename = filename
+        self.bkfile = bkfile
+        self.journal = Journal(journal, journal_limit) if journal else None
+        if self.journal and self.journal.has_aside():
+            with self.lock():
+                self._finish_write()
+        self.index = NodeIndex(index, filename) if index else None
+        self.fp = None
+        self.offsets = None
+        if self.index:
+            try:
+                self.fp = open(filename, 'rb')
+            except OSError:
+                pass
+            else:
+                self.offsets = self.index.load()
+                if self.offsets is None or self._stat(self.fp.fileno()) != self._stat():
+                    self.offsets = None # Replaced after being opened, so the index may not match 'fp'
+                    self.fp.close()
+                    self.fp = None
+        self.seen = {}
+        self.lazy = self.offsets is not None
+        self.journaled = self.journal is not None
+        self.bytes_read = self.index.size() if self.offsets is not None else 0
+        self.bytes_written = 0
+        self.processes = processes or os.cpu_count() or 1
+        self.stamp = self._stat(self.fp.fileno()) if self.fp else None
+        self.blocks = {}
+        self.journal_size = None if self.journal else 0
+        self.locked = False
+
+    def read(self, key):
+        if self.offsets is None:
+            return None
+        offset = self.offsets.get(key)
+        if offset is None or offset in self.seen:
+            return None
+        self.fp.seek(offset)
+        lines = _LineReader(self.fp, [])
+        node = TitleNode().read_from_csv(csv.reader(lines))
+        self.bytes_read += lines.offset - offset
+        self.seen[offset] = node
+        self.blocks[_digest(b''.join(lines.raw))] = node
+        return node
+
+    def read_all(self):
+        offsets = {}
+        fp, self.fp = self.fp, None
+        if fp and not self.seen:
+            fp.close() # Nothing was read from it, so the current file may be read instead
+            fp = None
+        if not fp:
+            self.stamp = self._stat()
+        try:
+            blocks = self._read_blocks(fp) if fp else self._read_blocks_parallel() or self._read_blocks()
+            for offset, digest, node in blocks:
+                if offset in self.seen:
+                    yield self.seen[offset], False
+                else:
+                    self._record_offset(offsets, node, offset)
+                    self.blocks[digest] = node
+                    yield node, True
+        except FileNotFoundError:
+            open(self.filename, "w") # May throw another FileNotFoundError, depending on 'filename'
+            self.stamp = self._stat() # So that refresh() doesn't take the new file for a change
+
+        if self.index and self.offsets is None:
+            self.bytes_written += self.index.save(offsets)
+        self.offsets = None
+        self.seen = {}
+
+    def names(self):
+        if self.offsets is None:
+            return None
+        return list(self.offsets)
+
+    def replay(self):
+        if not self.journal:
+            return iter(())
+        with self.lock(): # Records being appended are not read halfway
+            self.journal_size = self.journal.size()
+            records = list(self.journal.read(end=self.journal_size))
+        self.bytes_read += self.journal_size
+        return iter(records)
+
+    def refresh(self, reuse, rescan=False):
+        with self.lock():
+            stamp = self._stat()
+            size = self.journal.size() if self.journal else 0
+            if stamp == self.stamp:
+                if size == self.journal_size:
+                    return None
+                if not rescan and self.journal_size is not None and size > self.journal_size:
+                    # Only operations were appended since
+                    records = list(self.journal.read(self.journal_size, size))
+                    self.bytes_read += size - self.journal_size
+                    self.journal_size = size
+                    return None, records
+
+            nodes = self._rescan(reuse)
+            records = []
+            if self.journal:
+                records = list(self.journal.read(end=size))
+                self.bytes_read += size
+            self.journal_size = size
+            return nodes, records
+
+    def lock(self):
+        return self._file_lock(self.filename + '.lock')
+
+    def save(self, records):
+        if not self.journal:
+            return True
+        with self.lock():
+            start = self.journal.size()
+            appended = self.journal.append(records)
+        self.bytes_written += appended
+        if start == self.journal_size:
+            self.journal_size = start + appended
+        else:
+            self.journal_size = None # Others appended too, so it must all be read again
+        return self.journal.is_full()
+
+    def write_all(self, nodes):
+        """Writes all Nodes to the csv file, emptying the journal.
+        If a backup file was given, the old csv file becomes the backup.
+
+        Nodes are written to a temporary file, which replaces the csv file
+        only once it is safely on disk. If anything goes wrong before that,
+        the csv file is left untouched.
+
+        The lock is held meanwhile. Changes saved by others since the Nodes
+        were read are overwritten, unless refresh() was called under the lock."""
+        with self.lock():
+            self._write_all(nodes)
+
+    def _write_all(self, nodes):
+        if self.journal:
+            self._finish_write() # Before its csv file is overwritten
+        tmpname = self.filename + '.tmp'
+        offsets = {}
+        blocks = {}
+        try:
+            with open(tmpname, 'wb') as fp:
+                buf = io.StringIO()
+                wr = csv.writer(buf)
+                for node in nodes:
+                    self._record_offset(offsets, node, fp.tell())
+                    node.write_to_csv(wr)
+                    block = buf.getvalue().encode(_encoding)
+                    blocks[_digest(block)] = node
+                    fp.write(block)
+                    buf.seek(0)
+                    buf.truncate()
+                fp.flush()
+                os.fsync(fp.fileno())
+                self.bytes_written += fp.tell()
+        except:
+            print("FATAL: Exception upon writing new CSV file. Original CSV file was left untouched.")
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            st = None
+        else:
+            os.chmod(tmpname, st.st_mode & 0o7777)
+
+        # Saves the backup. Old contents are linked, not copied, to it
+        if self.bkfile and st and st.st_size > 0:
+            try:
+                os.link(self.filename, self.bkfile + '.tmp')
+            except FileExistsError:
+                os.remove(self.bkfile + '.tmp')
+                os.link(self.filename, self.bkfile + '.tmp')
+            except OSError:
+                # File system without hard links. Moving it leaves no csv file only briefly
+                os.replace(self.filename, self.bkfile)
+            else:
+                os.replace(self.bkfile + '.tmp', self.bkfile)
+
+        # The new csv file holds the records of the journal, so they are set aside
+        # first, and only discarded once it is in place
+        if self.journal:
+            self.journal.set_aside()
+            _fsync_dir(self.journal.filename)
+        os.replace(tmpname, self.filename)
+        _fsync_dir(self.filename)
+        if self.journal:
+            self.journal.discard_aside()
+            self.journal_size = 0
+        self.stamp = self._stat()
+        self.blocks = blocks
+
+        if self.index:
+            self.bytes_written += self.index.save(offsets)
+
+    def _finish_write(self):
+        """Finishes a _write_all() interrupted after the journal was set aside: the new csv
+        file replaces the old one, unless it did already, and the records set aside, which
+        it holds, are discarded. Must be called under the lock."""
+        if not self.journal.has_aside():
+            return
+        tmpname = self.filename + '.tmp'
+        if os.path.exists(tmpname):
+            os.replace(tmpname, self.filename)
+            _fsync_dir(self.filename)
+        self.journal.discard_aside()
+
+    def _read_blocks(self, fp=None):
+        """Yields tuples (offset, digest, node) for every node in the csv file,
+        where 'offset' is the byte offset at which the node's rows begin,
+        and 'digest' is the _digest() of those rows.
+        If the csv file is given already opened as 'fp', it is read from its start and closed."""
+        with fp or open(self.filename, 'rb') as fp:
+            fp.seek(0)
+            lines = _LineReader(fp, [])
+            rd = csv.reader(lines)
+            try:
+                while True:
+                    offset = lines.offset
+                    try:
+                        node = TitleNode().read_from_csv(rd)
+                    except ValueError:
+                        return
+                    yield offset, _digest(b''.join(lines.raw)), node
+                    lines.raw.clear()
+            finally:
+                self.bytes_read += lines.offset
+
+    def _rescan(self, reuse):
+        """Reads the csv file again, parsing only the nodes whose rows changed
+        since they were read or written, or whose node can't be reused.
+        Returns:
+            List of pairs (node, fresh), as yielded by read_all()."""
+        self.stamp = self._stat()
+        try:
+            with open(self.filename, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            data = b''
+        self.bytes_read += len(data)
+
+        nodes = []
+        blocks = {}
+        offsets = {}
+        pos = 0
+        while pos < len(data):
+            end = _next_row(data, _next_row(data, _next_row(data, pos)))
+            digest = _digest(data[pos:end])
+            node = self.blocks.pop(digest, None)
+            if node is not None and reuse(node):
+                nodes.append((node, False))
+            else:
+                try:
+                    node = TitleNode().read_from_csv(csv.reader(_LineReader(io.BytesIO(data[pos:end]))))
+                except ValueError:
+                    break
+                nodes.append((node, True))
+            blocks[digest] = node
+            self._record_offset(offsets, node, pos)
+            pos = end
+
+        self.blocks = blocks
+        self.offsets = None
+        self.seen = {}
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+        if self.index:
+            self.bytes_written += self.index.save(offsets)
+        return nodes
+
+    def _read_blocks_parallel(self):
+        """Reads the csv file as _read_blocks() does, in a pool of processes.
+        Returns:
+            Generator of tuples (offset, digest, node), or None if the file isn't worth
+            reading in parallel."""
+        if self.processes < 2:
+            return None
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return None
+        if size < max(1, self.parallel_min):
+            return None
+        bounds = self._chunk_bounds(size, self.processes * 2)
+        if len(bounds) < 3:
+            return None
+        return self._read_chunks(bounds)
+
+    def _read_chunks(self, bounds):
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(self.processes, len(bounds) - 1)) as pool:
+            # Chunks are merged in order, while later ones are still being parsed
+            futures = [pool.submit(_parse_chunk, self.filename, start, end)
+                       for start, end in zip(bounds, bounds[1:])]
+            try:
+                for future in futures:
+                    for offset, digest, names, comments, items in future.result():
+                        yield offset, digest, TitleNode().read_parsed(names, comments, items)
+            finally:
+                self.bytes_read += bounds[-1]
+                for future in futures:
+                    future.cancel()
+
+    def _chunk_bounds(self, size, parts):
+        """Splits the csv file of 'size' bytes in about 'parts' chunks, at offsets where Nodes begin.
+        Returns:
+            Sorted list of offsets, starting with 0 and ending with 'size'."""
+        if self.offsets is not None:
+            starts = sorted(set(self.offsets.values()))
+            bounds = [0]
+            for k in range(1, parts):
+                i = bisect_left(starts, size * k // parts)
+                if i < len(starts) and starts[i] > bounds[-1]:
+                    bounds.append(starts[i])
+            bounds.append(size)
+            return bounds
+
+        # Without an index, rows are counted to find where Nodes, of 3 rows each, begin
+        with open(self.filename, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            bounds = [0]
+            pos = rows = 0
+            for k in range(1, parts):
+                target = size * k // parts
+                if target <= pos:
+                    continue
+                count, pos = _count_rows(data, pos, target)
+                rows += count
+                if pos < size and data[pos - 1] != ord('\n'):
+                    pos = _next_row(data, pos) # Skips the rest of the current row
+                    rows += 1
+                while rows % 3 and pos < size:
+                    pos = _next_row(data, pos)
+                    rows += 1
+                if bounds[-1] < pos < size:
+                    bounds.append(pos)
+            bounds.append(size)
+            return bounds
+
+    def _stat(self, fd=None):
+        """Returns what tells whether the csv file was changed: its size, modification
+        time and inode, or None if it doesn't exist. If 'fd' is given, the file
+        opened as 'fd' is looked at instead."""
+        try:
+            st = os.stat(self.filename) if fd is None else os.fstat(fd)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def _record_offset(self, offsets, node, offset):
+        """Maps every name of 'node' to 'offset' in the dictionary 'offsets'."""
+        for name in [node.get_title()] + node.get_alias():
+            offsets.setdefault(self.normalize(name), offset)
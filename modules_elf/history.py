@@ -0,0 +1,213 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import csv
+import io
+import locale
+import os
+import shutil
+import time
+
+_encoding = locale.getpreferredencoding(False)
+
+class History:
+    """Class for managing the history of commands applied to a database,
+    so that they can be undone. The history is a csv file with one entry
+    per command, oldest first. Each entry is a row naming the command,
+    followed by the records of the operations that undo it, in the order
+    they must be applied. Records are written as in the journal:
+        #,[time],[command]
+        rm_item,[title],[item]
+        add_alias,[title],[alias]
+
+    Commands too large to keep in memory, like large imports, are appended
+    in parts, each later part beginning with a row '+'. As operations of a
+    later part were applied after those of the earlier ones, they are undone
+    first.
+
+    Entries are only ever appended, so saving a command costs as much as
+    describing how to undo it. Undoing commands removes their entries from
+    the end. Entries older than 'max_age' seconds are dropped, as are the
+    oldest ones once the file grows past 'max_size' bytes; the latest entry
+    is always kept, so that the last command can be undone.
+
+    Writers must keep each other out, as TitleManager does by holding the
+    lock of its Storage.
+
+    Exceptions:
+        TypeError - When any argument received has invalid type.
+        OSError - When the history file cannot be read or written.
+    """
+
+    # First field of the row that begins each entry
+    marker = '#'
+    # Only field of the row that begins each later part of an entry
+    part = '+'
+
+    def __init__(self, filename, max_age=30*24*3600, max_size=1<<20):
+        # filename: name of the history file
+        # max_age: seconds after which entries are dropped, or None to keep them regardless of age
+        # max_size: size, in bytes, above which the oldest entries are dropped, or None for no limit
+        if not isinstance(filename, str):
+            raise TypeError
+        # latest: byte offset at which the last entry appended through this History begins, or None
+        # end: size of the file after the last append through this History, or None
+        self.filename = filename
+        self.max_age = max_age
+        self.max_size = max_size
+        self.latest = None
+        self.end = None
+
+    def read(self):
+        """Returns all entries, oldest first, as tuples (offset, time, label, records):
+        the byte offset at which the entry begins, the time at which the command was
+        applied, in seconds since the epoch, the command and the records undoing it.
+        A missing history file is treated as an empty history."""
+        try:
+            with open(self.filename, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return []
+        return self._parse(data)
+
+    def append(self, entries, continued=False):
+        """Appends a list of entries, given as tuples (time, label, records), flushing them to disk.
+        If 'continued', the first entry is another part of the last entry appended through this
+          History, rather than an entry of its own, unless others appended to the file since.
+        Entries that became too old or don't fit anymore are dropped afterwards.
+        Returns the number of bytes appended."""
+        if not entries:
+            return 0
+        with open(self.filename, 'a', newline='') as fp:
+            start = fp.tell()
+            continued = continued and start == self.end
+            wr = csv.writer(fp)
+            for when, label, records in entries:
+                if continued:
+                    wr.writerow([self.part])
+                    continued = False
+                else:
+                    self.latest = fp.tell()
+                    wr.writerow([self.marker, int(when), label])
+                wr.writerows(records)
+            fp.flush()
+            os.fsync(fp.fileno())
+            self.end = fp.tell()
+        if self.max_size is not None and self.end - self.latest > self.max_size // 2:
+            if self.latest > 0:
+                self._keep_from(self.latest) # Only the latest entry fits, so the file needn't be parsed
+        elif self.latest > 0: # Otherwise the latest entry is the only one
+            self.prune()
+        return self.end - start
+
+    def truncate(self, offset):
+        """Drops the entries that begin at byte offset 'offset', as returned by read(), and all later ones."""
+        with open(self.filename, 'r+b') as fp:
+            fp.truncate(offset)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.latest = self.end = None
+
+    def prune(self, now=None):
+        """Drops the entries older than 'max_age' seconds before 'now', which defaults to the
+        current time. If the file is larger than 'max_size' bytes, drops the oldest entries
+        until it takes at most half of that, so that it isn't pruned again right away.
+        The whole file is only read when something must be dropped.
+        Returns the number of entries dropped."""
+        if now is None:
+            now = time.time()
+        size = self.size()
+        oldest = self._oldest()
+        if not (self.max_size is not None and size > self.max_size) \
+        and not (self.max_age is not None and oldest is not None and oldest < now - self.max_age):
+            return 0
+
+        with open(self.filename, 'rb') as fp:
+            data = fp.read()
+        entries = self._parse(data)
+        first = len(entries) - 1 # The latest entry is always kept
+        while first > 0:
+            offset, when, _, _ = entries[first - 1]
+            if self.max_age is not None and when < now - self.max_age:
+                break
+            if self.max_size is not None and len(data) - offset > self.max_size // 2:
+                break
+            first -= 1
+        if first <= 0:
+            return 0
+        self._keep_from(entries[first][0])
+        return first
+
+    def size(self):
+        """Returns the size of the history in bytes."""
+        try:
+            return os.path.getsize(self.filename)
+        except FileNotFoundError:
+            return 0
+
+    def _keep_from(self, offset):
+        """Drops the entries before byte offset 'offset', replacing the file safely."""
+        tmpname = self.filename + '.tmp'
+        with open(self.filename, 'rb') as src, open(tmpname, 'wb') as fp:
+            src.seek(offset)
+            shutil.copyfileobj(src, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmpname, self.filename)
+        if self.end is not None:
+            self.latest -= offset # The latest entry is always kept
+            self.end -= offset
+
+    def _oldest(self):
+        """Returns the time of the oldest entry, or None if there is none. Only its first row is read."""
+        try:
+            with open(self.filename, newline='') as fp:
+                row = next(csv.reader(fp), None)
+        except FileNotFoundError:
+            return None
+        return self._header_time(row)
+
+    def _header_time(self, row):
+        """Returns the time in 'row' if it begins an entry, or None otherwise."""
+        if not row or row[0] != self.marker or len(row) < 3:
+            return None
+        try:
+            return float(row[1])
+        except ValueError:
+            return 0.0 # Damaged, so it is the first to go
+
+    def _parse(self, data):
+        """Parses the bytes 'data' of a history file into entries, as returned by read().
+        Records before the first entry are ignored."""
+        entries = []
+        buf = io.BytesIO(data)
+        start = 0
+        # The csv reader takes only the lines of one row at a time, so buf.tell() is where the row ends
+        for row in csv.reader(line.decode(_encoding) for line in buf):
+            when = self._header_time(row)
+            if when is not None:
+                part = []
+                entries.append((start, when, row[2], [part]))
+            elif row == [self.part] and entries:
+                part = []
+                entries[-1][3].insert(0, part) # Later parts are undone first
+            elif row and entries:
+                part.append(row)
+            start = buf.tell()
+        return [(offset, when, label, [record for part in parts for record in part])
+                for offset, when, label, parts in entries]
@@ -0,0 +1,111 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import csv
+import io
+import locale
+import os
+
+class Journal:
+    """Class for managing an append-only journal of operations.
+    Each record is a csv row holding the name of a TitleManager operation
+    followed by its arguments, for example:
+        add_item,[title],[item]
+        rm_alias,[alias]
+
+    Records are only ever appended, so saving a change costs as much as the
+    change itself. The journal is emptied once its records are folded into
+    the main csv file. Meanwhile they are set aside, in a file named after
+    the journal with '.old' appended, until the csv file holding them is in
+    place, so that they are neither lost nor replayed twice after a crash.
+
+    Exceptions:
+        TypeError - When any argument received has invalid type.
+        OSError - When the journal file cannot be read or written.
+    """
+
+    def __init__(self, filename, limit=1<<20):
+        # filename: name of the journal file
+        # limit: size, in bytes, above which the journal should be compacted
+        # aside: name of the file holding the records set aside by set_aside()
+        if not isinstance(filename, str):
+            raise TypeError
+        self.filename = filename
+        self.limit = limit
+        self.aside = filename + '.old'
+
+    def read(self, start=0, end=None):
+        """Yields every record in the journal, oldest first.
+        If 'start' or 'end' are given, only records between those byte offsets are read.
+        A missing journal file is treated as an empty journal."""
+        try:
+            with open(self.filename, 'rb') as fp:
+                fp.seek(start)
+                data = fp.read() if end is None else fp.read(max(0, end - start))
+        except FileNotFoundError:
+            return
+        for row in csv.reader(io.StringIO(data.decode(locale.getpreferredencoding(False)), newline='')):
+            if row:
+                yield row
+
+    def append(self, records):
+        """Appends a list of records to the journal, flushing them to disk.
+        Returns the number of bytes appended."""
+        if not records:
+            return 0
+        with open(self.filename, 'a', newline='') as fp:
+            start = fp.tell()
+            csv.writer(fp).writerows(records)
+            fp.flush()
+            os.fsync(fp.fileno())
+            return fp.tell() - start
+
+    def size(self):
+        """Returns the size of the journal in bytes."""
+        try:
+            return os.path.getsize(self.filename)
+        except FileNotFoundError:
+            return 0
+
+    def is_full(self):
+        """Checks if the journal has grown past its size limit."""
+        return self.size() > self.limit
+
+    def clear(self):
+        """Discards all records in the journal, flushing that to disk."""
+        with open(self.filename, 'w') as fp:
+            os.fsync(fp.fileno())
+
+    def set_aside(self):
+        """Moves all records out of the journal, leaving it empty, to the file
+        named 'aside', where they are kept until discard_aside() is called."""
+        try:
+            os.replace(self.filename, self.aside)
+        except FileNotFoundError:
+            pass
+
+    def has_aside(self):
+        """Checks if records were set aside and not discarded yet."""
+        return os.path.exists(self.aside)
+
+    def discard_aside(self):
+        """Discards the records set aside by set_aside()."""
+        try:
+            os.remove(self.aside)
+        except FileNotFoundError:
+            pass
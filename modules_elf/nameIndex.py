@@ -0,0 +1,162 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import heapq
+from bisect import bisect_left
+from collections import Counter
+
+def _trigrams(string):
+    """Returns the set of 3-character substrings of 'string', padded so that
+    its beginning weighs more and even short strings have some. Characters
+    of each substring are sorted, so that swapping two adjacent characters,
+    the most common typo, leaves the substrings holding both unchanged."""
+    s = '  ' + string + ' '
+    grams = set()
+    for i in range(len(s) - 2):
+        g = s[i:i+3]
+        key = _sorted.get(g)
+        if key is None:
+            key = _sorted[g] = ''.join(sorted(g))
+        grams.add(key)
+    return grams
+
+# Maps each trigram seen to its sorted characters, which are costly to sort each time
+_sorted = {}
+
+def _distance(a, b):
+    """Returns the number of characters to insert, delete or replace, and of
+    adjacent characters to swap, to turn string 'a' into string 'b'."""
+    before, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d = min(d, before[j - 2] + 1)
+            cur[j] = d
+        before, prev = prev, cur
+    return prev[-1]
+
+class NameIndex:
+    """Class for looking up strings by prefix or by similarity.
+
+    Strings are kept sorted, so those starting with a prefix are found by
+    binary search, in order, as a trie would find them. For similarity,
+    each string is split in trigrams, and the strings sharing the most
+    trigrams with the one looked up are ranked by their edit distance to it.
+    The trigram index is only built on the first similarity lookup.
+
+    Strings are indexed as given; normalizing them is up to the caller.
+    """
+
+    def __init__(self, strings=()):
+        # strings: sorted list of indexed strings
+        # grams: maps each trigram to the set of strings containing it, or None until needed
+        self.strings = sorted(set(strings))
+        self.grams = None
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, string):
+        i = bisect_left(self.strings, string)
+        return i < len(self.strings) and self.strings[i] == string
+
+    def add(self, string):
+        """Adds 'string' to the index, if it isn't there yet."""
+        i = bisect_left(self.strings, string)
+        if i < len(self.strings) and self.strings[i] == string:
+            return
+        self.strings.insert(i, string)
+        if self.grams is not None:
+            for g in _trigrams(string):
+                self.grams.setdefault(g, set()).add(string)
+
+    def discard(self, string):
+        """Removes 'string' from the index, if it is there."""
+        i = bisect_left(self.strings, string)
+        if i == len(self.strings) or self.strings[i] != string:
+            return
+        del self.strings[i]
+        if self.grams is not None:
+            for g in _trigrams(string):
+                holders = self.grams[g]
+                holders.discard(string)
+                if not holders:
+                    del self.grams[g]
+
+    def prefix(self, prefix, limit=None):
+        """Yields the strings starting with 'prefix', in sorted order, at most 'limit' of them."""
+        i = bisect_left(self.strings, prefix)
+        end = len(self.strings) if limit is None else min(len(self.strings), i + limit)
+        while i < end and self.strings[i].startswith(prefix):
+            yield self.strings[i]
+            i += 1
+
+    def similar(self, string, limit=10, cutoff=0.5):
+        """Finds the strings most similar to 'string', tolerating typos.
+        Only strings whose similarity is at least 'cutoff' are returned, similarity
+        being 1 minus their edit distance divided by the length of the longer string.
+        Returns:
+            List of pairs (similarity, string), most similar first."""
+        if self.grams is None:
+            self._build_grams()
+        grams = _trigrams(string)
+        postings = sorted([self.grams[g] for g in grams if g in self.grams], key=len)
+        if not postings:
+            return []
+
+        # Trigrams found in many strings say little about any of them, and are
+        # the costly ones to count, so only the rarest ones pick candidates.
+        # A typo spoils at most 3 trigrams, so a few rare ones are usually enough.
+        # Short strings may only share common ones, which are counted if need be.
+        common = max(100, len(self.strings) // 100)
+        rare = [p for p in postings[:8] if len(p) <= common] or postings[:1]
+        scored = self._scored(string, len(grams), rare, limit, cutoff)
+        if not scored and len(rare) < len(postings):
+            scored = self._scored(string, len(grams), postings, limit, cutoff)
+        return scored
+
+    def _scored(self, string, n, postings, limit, cutoff):
+        """Returns the pairs (similarity, string) of the strings in 'postings' most similar
+        to 'string', which has 'n' trigrams, as similar() does."""
+        shared = Counter()
+        for p in postings:
+            shared.update(p)
+        # Strings have about as many trigrams as characters, so the fraction of
+        # trigrams shared is estimated without splitting every one of them
+        candidates = heapq.nlargest(limit * 3, shared, key=lambda s: shared[s] / (n + len(s) - shared[s]))
+
+        scored = []
+        for s in candidates:
+            score = 1 - _distance(string, s) / max(len(string), len(s))
+            if score >= cutoff:
+                scored.append((score, s))
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored[:limit]
+
+    def _build_grams(self):
+        grams = {}
+        for string in self.strings:
+            for g in _trigrams(string):
+                holders = grams.get(g)
+                if holders is None:
+                    grams[g] = {string}
+                else:
+                    holders.add(string)
+        self.grams = grams
@@ -32,9 +32,14 @@ class NamedEntity:
                      Happens when trying to add an alias that already exists, for example.
     """
 
+    __slots__ = ('title', 'alias', 'dirty')
+
     def __init__(self, title="Null"):
+        # alias: set of aliases, or None until the first one is added
+        # dirty: whether title or aliases changed since the last mark_clean()
         self.title = title
-        self.alias = set([])
+        self.alias = None
+        self.dirty = False
 
     # Objects will be compared by their titles.
     def __eq__(self,other): return self.title.lower() == other.title.lower()
@@ -56,13 +61,14 @@ class NamedEntity:
             self.title = string
         else:
             self.title = "Null"
+        self.dirty = True
 
     def has_alias(self, alias):
         """Checks if this Node contains the given alias.
         Aliases are case-insentively compared."""
         if not isinstance(alias, str):
             raise TypeError
-        if alias.lower() in self.alias:
+        if self.alias and alias.lower() in self.alias:
             return True
         return False
 
@@ -75,7 +81,10 @@ class NamedEntity:
             raise TypeError
         if self.has_alias(alias):
             raise ValueError
+        if self.alias is None:
+            self.alias = set()
         self.alias.add(alias.lower())
+        self.dirty = True
 
     def rm_alias(self, alias):
         """Removes given 'alias' from this Node.
@@ -87,8 +96,19 @@ class NamedEntity:
         if not self.has_alias(alias):
             raise ValueError
         self.alias.remove(alias.lower())
+        self.dirty = True
 
     def get_alias(self):
         """Returns a list with all aliases of this Node.
         List is returned in no particular order."""
+        if not self.alias:
+            return []
         return [i for i in self.alias]
+
+    def is_dirty(self):
+        """Checks if this Node changed since the last call to mark_clean()."""
+        return self.dirty
+
+    def mark_clean(self):
+        """Marks the current state of this Node as saved."""
+        self.dirty = False
@@ -0,0 +1,92 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import csv
+import os
+
+class NodeIndex:
+    """Class for managing the index file of a csv file of Nodes.
+    The index maps each normalized title and alias to the byte offset where
+    the 3 rows of its Node begin in the csv file. Its format is:
+        [size of csv file],[modification time of csv file, in ns]
+        [name1],[offset1]
+        [name2],[offset2]
+        ...
+
+    The first row tells which version of the csv file the index describes;
+    an index that doesn't match the csv file anymore is ignored.
+
+    Exceptions:
+        TypeError - When any argument received has invalid type.
+    """
+
+    def __init__(self, filename, csvname):
+        # filename: name of the index file
+        # csvname: name of the csv file being indexed
+        if not isinstance(filename, str) or not isinstance(csvname, str):
+            raise TypeError
+        self.filename = filename
+        self.csvname = csvname
+
+    def load(self):
+        """Reads the index file.
+        Returns:
+            Dictionary mapping names to offsets, if the index matches the csv file.
+            None otherwise."""
+        stamp = self._stamp()
+        if stamp is None:
+            return None
+        try:
+            with open(self.filename, newline='') as fp:
+                rd = csv.reader(fp)
+                if next(rd, None) != stamp:
+                    return None
+                return {name: int(offset) for name, offset in rd}
+        except (OSError, ValueError):
+            return None
+
+    def save(self, offsets):
+        """Writes the dictionary 'offsets' as the index of the current csv file.
+        Returns the number of bytes written."""
+        stamp = self._stamp()
+        if stamp is None:
+            return 0
+        try:
+            with open(self.filename, 'w', newline='') as fp:
+                wr = csv.writer(fp)
+                wr.writerow(stamp)
+                wr.writerows(offsets.items())
+                return fp.tell()
+        except OSError:
+            return 0 # The index is only an optimization
+
+    def size(self):
+        """Returns the size of the index file in bytes."""
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return 0
+
+    def _stamp(self):
+        """Returns the first row of an index that matches the current csv file,
+        or None if the csv file doesn't exist."""
+        try:
+            st = os.stat(self.csvname)
+        except OSError:
+            return None
+        return [str(st.st_size), str(st.st_mtime_ns)]
@@ -0,0 +1,96 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+
+import re
+
+# Escape sequences of TSV fields, as written by Renderer
+_tsv_escapes = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r'}
+
+def _tsv_unescape(field):
+    """Reverts the escaping of backslashes, tabs and line breaks in a TSV field."""
+    if '\\' not in field:
+        return field
+    return re.sub(r'\\(.)', lambda m: _tsv_escapes.get(m.group(1), m.group(0)), field)
+
+class RecordReader:
+    """Class that reads records (title, alias, item, comment) from a text stream,
+    in one of the formats written by Renderer.records():
+        tsv - One record per line, with up to 4 tab-separated fields, escaped
+              as Renderer does. Missing fields are empty.
+        jsonl - One JSON object per line, with keys 'title', 'alias', 'item'
+                and 'comment'. All of them but 'title' may be left out.
+
+    Iterating over a RecordReader yields records as tuples of 4 strings,
+    empty for fields not given. Lines are read one at a time, so streams of
+    any size can be read. Blank lines are skipped, and so is a tsv header
+    line naming the fields. Invalid lines, like those without a title, are
+    skipped as well, and their numbers kept in 'invalid'.
+
+    Exceptions:
+        ValueError - When the format is unknown.
+    """
+
+    formats = ('tsv', 'jsonl')
+    fields = ('title', 'alias', 'item', 'comment')
+
+    def __init__(self, fp, fmt='tsv'):
+        # fp: stream from which records are read
+        # fmt: one of 'formats'
+        # invalid: numbers of the lines skipped for not being valid records
+        if fmt not in self.formats:
+            raise ValueError
+        self.fp = fp
+        self.fmt = fmt
+        self.invalid = []
+
+    def __iter__(self):
+        parse = self._parse_tsv if self.fmt == 'tsv' else self._parse_json
+        for number, line in enumerate(self.fp, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            if number == 1 and self.fmt == 'tsv' and tuple(line.split('\t')) == self.fields:
+                continue # Header
+            record = parse(line)
+            if record is None or not record[0].strip():
+                self.invalid.append(number)
+                continue
+            yield record
+
+    def _parse_tsv(self, line):
+        fields = line.split('\t')
+        if len(fields) > len(self.fields):
+            return None
+        fields += [''] * (len(self.fields) - len(fields))
+        if '\\' not in line:
+            return tuple(fields)
+        return tuple(_tsv_unescape(f) for f in fields)
+
+    def _parse_json(self, line):
+        import json # Only needed for this format
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(obj, dict):
+            return None
+        record = tuple(obj.get(f) or '' for f in self.fields)
+        if not all(isinstance(f, str) for f in record):
+            return None
+        return record
@@ -0,0 +1,176 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import os
+import sys
+from itertools import islice
+
+from . import colors
+
+class Renderer:
+    """Class that writes TitleNodes to a stream, in one of the formats:
+        text - The layout of TitleNode.print_line() and print_block(),
+               colored if colors are enabled (see modules_elf.colors).
+        plain - The same layout, never colored.
+        tsv - One line per Node, with tab-separated fields.
+        jsonl - One JSON object per Node and per line.
+
+    Nodes are taken from any iterable, so they can be streamed from a
+    generator. Output is gathered in a buffer, written out once it holds
+    'buffer_size' characters. If the reader goes away (e.g. a closed pipe,
+    as in '| head'), rendering stops and 'closed' is set.
+
+    Records of Titles, aliases, items and comments, as exported by
+    TitleManager.export_records(), are written by records() likewise.
+
+    A 'label', like the name of the database Nodes come from, can be added
+    to each tsv line, as its first field, and to each jsonl object, as its
+    'database' key.
+
+    Exceptions:
+        ValueError - When the format is unknown.
+    """
+
+    formats = ('text', 'plain', 'tsv', 'jsonl')
+
+    def __init__(self, out=None, fmt='text', buffer_size=1<<16, label=None):
+        # out: stream written to. Defaults to sys.stdout at the time of each write.
+        # fmt: one of 'formats'
+        # label: added to tsv and jsonl records, if given
+        # buf: pending strings, and size their total length
+        # closed: whether the reader went away
+        if fmt not in self.formats:
+            raise ValueError
+        self.out = out
+        self.fmt = fmt
+        self.color = fmt == 'text' and colors.is_enabled()
+        self.buffer_size = buffer_size
+        self.label = label
+        self.buf = []
+        self.size = 0
+        self.closed = False
+
+    def summary(self, nodes, offset=0, limit=None, width=40):
+        """Writes the title and aliases of each Node in 'nodes',
+        skipping the first 'offset' ones and writing at most 'limit' of them.
+        Returns the number of Nodes written."""
+        return self._render(nodes, offset, limit, lambda node: self._line(node, width))
+
+    def full(self, nodes, length=-1, offset=0, limit=None):
+        """Writes all information about each Node in 'nodes', with only the latest
+        'length' items, skipping the first 'offset' Nodes and writing at most 'limit' of them.
+        Returns the number of Nodes written."""
+        return self._render(nodes, offset, limit, lambda node: self._block(node, length))
+
+    def records(self, records):
+        """Writes each tuple (title, alias, item, comment) in 'records', as read by RecordReader.
+        Only the tsv and jsonl formats can hold records: tsv lines have the 4 fields,
+        while jsonl objects leave out the empty ones.
+        Returns the number of records written.
+        Raises:
+            ValueError - When the format can't hold records."""
+        if self.fmt == 'tsv':
+            fmt_record = lambda record: self._tsv_line(list(record))
+        elif self.fmt == 'jsonl':
+            keys = ('title', 'alias', 'item', 'comment')
+            fmt_record = lambda record: self._json_line({k: f for k, f in zip(keys, record) if f})
+        else:
+            raise ValueError
+        return self._render(records, 0, None, fmt_record)
+
+    def write(self, text):
+        """Adds 'text' to the output, writing out the buffer if it is full."""
+        if self.closed:
+            return
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes out all buffered text."""
+        if self.closed or not self.buf:
+            return
+        text = ''.join(self.buf)
+        self.buf = []
+        self.size = 0
+        out = self.out if self.out is not None else sys.stdout
+        try:
+            out.write(text)
+            out.flush()
+        except BrokenPipeError:
+            self.closed = True
+            # Python flushes stdout again on exit, which would fail the same way
+            try:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, out.fileno())
+            except (AttributeError, OSError, ValueError):
+                pass
+
+    def _render(self, nodes, offset, limit, fmt_node):
+        """Writes fmt_node(node) for the selected Nodes, flushing at the end."""
+        stop = None if limit is None else offset + max(0, limit)
+        count = 0
+        try:
+            for node in islice(nodes, offset, stop):
+                self.write(fmt_node(node))
+                if self.closed:
+                    break
+                count += 1
+        finally:
+            self.flush()
+        return count
+
+    def _line(self, node, width):
+        if self.fmt == 'tsv':
+            return self._tsv_line([node.get_title(), ','.join(node.get_alias())])
+        if self.fmt == 'jsonl':
+            return self._json_line({'title': node.get_title(), 'aliases': node.get_alias()})
+        return node.format_line(width, self.color) + '\n'
+
+    def _block(self, node, length):
+        if self.fmt == 'tsv':
+            return self._tsv_line([
+                node.get_title(),
+                ','.join(node.get_alias()),
+                ' | '.join(node.get_comment_list()),
+                ', '.join(node.get_items(length)),
+            ])
+        if self.fmt == 'jsonl':
+            return self._json_line({
+                'title': node.get_title(),
+                'aliases': node.get_alias(),
+                'comments': list(node.get_comment_list()),
+                'items': node.get_items(length),
+            })
+        return node.format_block(length, self.color) + '\n'
+
+    def _tsv_line(self, fields):
+        if self.label is not None:
+            fields.insert(0, self.label)
+        return '\t'.join([_tsv_field(f) for f in fields]) + '\n'
+
+    def _json_line(self, obj):
+        import json # Only needed for this format
+        if self.label is not None:
+            obj = dict(database=self.label, **obj)
+        return json.dumps(obj) + '\n'
+
+def _tsv_field(string):
+    """Escapes backslashes, tabs and line breaks in a TSV field."""
+    return string.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
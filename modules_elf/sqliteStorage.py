@@ -0,0 +1,214 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import sqlite3
+
+from .storage import Storage
+from .titleNode import TitleNode
+
+_schema = """
+CREATE TABLE IF NOT EXISTS titles (id INTEGER PRIMARY KEY, title TEXT NOT NULL, key TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS aliases (title_id INTEGER NOT NULL, alias TEXT NOT NULL, key TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS comments (title_id INTEGER NOT NULL, comment TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS items (title_id INTEGER NOT NULL, item TEXT NOT NULL, key TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS titles_key ON titles (key);
+CREATE INDEX IF NOT EXISTS aliases_key ON aliases (key);
+CREATE INDEX IF NOT EXISTS aliases_title ON aliases (title_id);
+CREATE INDEX IF NOT EXISTS comments_title ON comments (title_id);
+CREATE INDEX IF NOT EXISTS items_key ON items (key);
+CREATE UNIQUE INDEX IF NOT EXISTS items_title ON items (title_id, key);
+"""
+
+class SqliteStorage(Storage):
+    """Storage that keeps all Nodes in an SQLite database, with one table for
+    each of titles, aliases, comments and items.
+
+    Nodes are read one at a time by indexed queries, and each save applies
+    the operations it is given in a single transaction. As when the journal
+    is replayed, operations that no longer apply, because others changed the
+    same Titles since, are skipped rather than failing the whole save.
+    The order of comments and items is the order of their rows.
+
+    As with CsvStorage, lock() takes an exclusive lock on a file named after
+    the database file, with '.lock' appended, so that saves and the History
+    written along with them are kept apart from those of other processes.
+
+    Exceptions:
+        TypeError - When any argument received has invalid type.
+        sqlite3.Error - When the database cannot be read or written.
+    """
+
+    lazy = True
+    journaled = True
+
+    def __init__(self, filename):
+        # filename: name of the SQLite database file
+        # seen: maps ids of titles returned by read() to the nodes returned
+        if not isinstance(filename, str):
+            raise TypeError
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(_schema)
+        self.seen = {}
+
+    def read(self, key):
+        tid = self._title_id(key)
+        if tid is None or tid in self.seen:
+            return None
+        row = self.db.execute("SELECT title FROM titles WHERE id = ?", (tid,)).fetchone()
+        node = self._make_node(row[0],
+            [r[0] for r in self.db.execute("SELECT alias FROM aliases WHERE title_id = ?", (tid,))],
+            [r[0] for r in self.db.execute("SELECT comment FROM comments WHERE title_id = ? ORDER BY rowid", (tid,))],
+            [r[0] for r in self.db.execute("SELECT item FROM items WHERE title_id = ? ORDER BY rowid", (tid,))])
+        self.seen[tid] = node
+        return node
+
+    def read_all(self):
+        aliases, comments, items = {}, {}, {}
+        for tid, alias in self.db.execute("SELECT title_id, alias FROM aliases"):
+            aliases.setdefault(tid, []).append(alias)
+        for tid, comm in self.db.execute("SELECT title_id, comment FROM comments ORDER BY rowid"):
+            comments.setdefault(tid, []).append(comm)
+        for tid, item in self.db.execute("SELECT title_id, item FROM items ORDER BY rowid"):
+            items.setdefault(tid, []).append(item)
+
+        for tid, title in self.db.execute("SELECT id, title FROM titles ORDER BY key, id").fetchall():
+            if tid in self.seen:
+                yield self.seen[tid], False
+            else:
+                yield self._make_node(title, aliases.get(tid, []), comments.get(tid, []), items.get(tid, [])), True
+        self.seen = {}
+
+    def holders(self, item):
+        return [r[0] for r in self.db.execute(
+            "SELECT titles.title FROM items JOIN titles ON titles.id = items.title_id WHERE items.key = ?",
+            (item.lower(),))]
+
+    def names(self):
+        return [r[0] for r in self.db.execute("SELECT key FROM titles UNION SELECT key FROM aliases")]
+
+    def lock(self):
+        return self._file_lock(self.filename + '.lock')
+
+    def save(self, records):
+        with self.db:
+            for record in records:
+                try:
+                    getattr(self, '_' + record[0])(*record[1:])
+                except IndexError:
+                    pass # A comment removed by others meanwhile
+        return False
+
+    def write_all(self, nodes):
+        with self.db:
+            for table in ('titles', 'aliases', 'comments', 'items'):
+                self.db.execute("DELETE FROM " + table)
+            for node in nodes:
+                tid = self._add_title(node.get_title())
+                for alias in node.get_alias():
+                    self._add_alias_to(tid, alias)
+                for comm in node.get_comment().get_list():
+                    self._add_comment_to(tid, comm)
+                for item in node.get_items():
+                    self._add_item_to(tid, item)
+        self.seen = {}
+
+    @staticmethod
+    def _make_node(title, aliases, comments, items):
+        """Builds a TitleNode out of the values stored in each table."""
+        title_row = [title]
+        title_row.extend(aliases)
+        return TitleNode().read_from_csv(iter([title_row, comments, items]))
+
+    def _title_id(self, key):
+        """Returns the id of the title whose normalized title or alias is 'key', or None."""
+        row = self.db.execute("SELECT id FROM titles WHERE key = ? ORDER BY id LIMIT 1", (key,)).fetchone()
+        if row is None:
+            row = self.db.execute("SELECT title_id FROM aliases WHERE key = ? LIMIT 1", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _add_title(self, title):
+        """Inserts a title, returning its id."""
+        return self.db.execute("INSERT INTO titles (title, key) VALUES (?, ?)",
+                               (title, self.normalize(title))).lastrowid
+
+    # Each method below applies an operation record, as named in the journal.
+    # Records hold the title of the node the operation was applied to.
+    # Records that no longer apply, such as those on titles removed since, do nothing.
+
+    def _add_node(self, title):
+        if self._title_id(self.normalize(title)) is None:
+            self._add_title(title)
+
+    def _rm_node(self, title):
+        tid = self._title_id(self.normalize(title))
+        if tid is None:
+            return
+        for table in ('aliases', 'comments', 'items'):
+            self.db.execute("DELETE FROM " + table + " WHERE title_id = ?", (tid,))
+        self.db.execute("DELETE FROM titles WHERE id = ?", (tid,))
+
+    def _add_alias(self, title, alias):
+        tid = self._title_id(self.normalize(title))
+        if tid is not None and self._title_id(self.normalize(alias)) is None:
+            self._add_alias_to(tid, alias.lower())
+
+    def _add_alias_to(self, tid, alias):
+        self.db.execute("INSERT INTO aliases (title_id, alias, key) VALUES (?, ?, ?)",
+                        (tid, alias, self.normalize(alias)))
+
+    def _rm_alias(self, alias):
+        self.db.execute("DELETE FROM aliases WHERE key = ?", (self.normalize(alias),))
+
+    def _add_comment(self, title, *comments):
+        tid = self._title_id(self.normalize(title))
+        if tid is None:
+            return
+        for comm in comments:
+            self._add_comment_to(tid, comm)
+
+    def _add_comment_to(self, tid, comm):
+        self.db.execute("INSERT INTO comments (title_id, comment) VALUES (?, ?)", (tid, comm))
+
+    def _comment_rowid(self, title, n):
+        """Returns the rowid of the n-th comment of the node titled 'title'.
+        Raises:
+            IndexError - There is no such node or comment."""
+        tid = self._title_id(self.normalize(title))
+        rowids = [r[0] for r in self.db.execute(
+            "SELECT rowid FROM comments WHERE title_id = ? ORDER BY rowid", (tid,))]
+        return rowids[int(n)]
+
+    def _set_comment(self, title, n, comm):
+        self.db.execute("UPDATE comments SET comment = ? WHERE rowid = ?", (comm, self._comment_rowid(title, n)))
+
+    def _rm_comment(self, title, n):
+        self.db.execute("DELETE FROM comments WHERE rowid = ?", (self._comment_rowid(title, n),))
+
+    def _add_item(self, title, item):
+        tid = self._title_id(self.normalize(title))
+        if tid is not None:
+            self._add_item_to(tid, item)
+
+    def _add_item_to(self, tid, item):
+        # Ignored if the title has the item already
+        self.db.execute("INSERT OR IGNORE INTO items (title_id, item, key) VALUES (?, ?, ?)", (tid, item, item.lower()))
+
+    def _rm_item(self, title, item):
+        self.db.execute("DELETE FROM items WHERE title_id = ? AND key = ?",
+                        (self._title_id(self.normalize(title)), item.lower()))
@@ -0,0 +1,130 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+from contextlib import contextmanager
+
+class Storage:
+    """Base class for the places where a TitleManager keeps its TitleNodes.
+    A TitleManager holds in memory the Nodes it has read so far, and uses its
+    Storage to:
+        1) Read Nodes, either one at a time by name or all of them.
+        2) Answer queries about Nodes it hasn't read yet.
+        3) Save the operations applied to its Nodes, or all of its Nodes.
+
+    Operations are described by records, as written to the journal:
+    the name of a TitleManager method followed by its arguments.
+
+    Attributes:
+        lazy - Whether Nodes can be read one at a time, through read().
+        journaled - Whether save() can save operation records.
+                    If not, saving means writing all Nodes with write_all().
+        bytes_read, bytes_written - Number of bytes transferred so far, if known.
+
+    Exceptions:
+        NotImplementedError - When the subclass doesn't support an operation.
+    """
+
+    lazy = False
+    journaled = False
+    bytes_read = 0
+    bytes_written = 0
+    # Whether this process holds the lock of the Storage, if it has one
+    locked = False
+
+    @staticmethod
+    def normalize(string):
+        """Returns the key under which a title or alias 'string' is looked up."""
+        return string.strip().lower()
+
+    def read(self, key):
+        """Reads the Node whose normalized title or alias is 'key'.
+        Returns:
+            The Node read, or None if there is no such Node or if it was read before."""
+        return None
+
+    def read_all(self):
+        """Yields pairs (node, fresh) for all Nodes, in the order they are stored.
+        'fresh' is False for Nodes that were returned by read() before,
+        in which case 'node' is the same object returned then."""
+        raise NotImplementedError
+
+    def holders(self, item):
+        """Returns the titles of the stored Nodes that contain 'item',
+        or None if that can only be answered by reading all Nodes."""
+        return None
+
+    def names(self):
+        """Returns the normalized titles and aliases of all stored Nodes,
+        or None if that can only be answered by reading all Nodes."""
+        return None
+
+    def replay(self):
+        """Yields records of operations that must be applied after reading Nodes."""
+        return iter(())
+
+    def refresh(self, reuse, rescan=False):
+        """Checks whether the stored Nodes were changed by someone else, like
+        another process or a person editing files by hand, since they were last
+        read or written through this Storage.
+        'reuse' is a function telling whether a Node returned before may stand
+        for its stored contents, which it can't if it was changed in memory since.
+        If 'rescan', Nodes are checked even if only operations were saved since.
+        Returns:
+            None if nothing changed, or if changes cannot be detected.
+            Otherwise, a pair (nodes, records). If Nodes changed, 'nodes' lists
+            pairs (node, fresh) for all Nodes, as yielded by read_all(), and
+            'records' are all operations that must be applied afterwards.
+            Else 'nodes' is None and 'records' are the operations saved since."""
+        return None
+
+    @contextmanager
+    def lock(self):
+        """Context manager that keeps other processes from saving to this Storage
+        while inside it. Entering it again while inside it does nothing."""
+        yield
+
+    @contextmanager
+    def _file_lock(self, filename):
+        """Context manager that holds an exclusive lock on the file 'filename', created if
+        needed, for Storages to implement lock() with. Where file locks are not available,
+        nothing is locked. Entering it again while inside it does nothing."""
+        if self.locked:
+            yield
+            return
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        with open(filename, 'a') as fp:
+            if fcntl:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            self.locked = True
+            try:
+                yield
+            finally:
+                self.locked = False # Closing the file releases the lock
+
+    def save(self, records):
+        """Saves the operations described by the list 'records'.
+        Returns:
+            True if all Nodes should now be written with write_all()."""
+        raise NotImplementedError
+
+    def write_all(self, nodes):
+        """Replaces all stored Nodes with the list 'nodes'."""
+        raise NotImplementedError
@@ -0,0 +1,59 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+from contextlib import contextmanager
+from time import perf_counter
+
+class Timings:
+    """Class that accumulates the wall time spent in named phases, like
+    'load' or 'save'. Phases can be nested; a phase entered again while it is
+    already running is counted only once.
+
+    Usage:
+        with timings.phase('load'):
+            ...
+        timings.get() # {'load': seconds}
+    """
+
+    def __init__(self):
+        # phases: maps the name of each phase to the seconds spent in it, in order of first use
+        # active: names of the phases currently running
+        self.phases = {}
+        self.active = set()
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager that adds the time spent inside it to phase 'name'."""
+        if name in self.active:
+            yield
+            return
+        self.active.add(name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+            self.active.discard(name)
+
+    def add(self, name, seconds):
+        """Adds 'seconds' to phase 'name'."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def get(self):
+        """Returns a dictionary mapping each phase to the seconds spent in it."""
+        return dict(self.phases)
@@ -16,10 +16,19 @@
 #
 #    Contact: matheus.saldanha@usp.br
 
-import termcolor as tc
-import csv
+import sys
+import time
+import heapq
+import bisect
+from itertools import islice
 
 from .titleNode import TitleNode
+from .storage import Storage
+from .csvStorage import CsvStorage
+from .timings import Timings
+from .nameIndex import NameIndex
+from .renderer import Renderer
+from .history import History
 
 # String stripping and trimming is done here.
 
@@ -29,6 +38,24 @@ class TitleManager:
         2) Apply operations upon the list of Nodes.
         3) Saves the processed list of Nodes in a csv file.
 
+    The csv file is handled by a CsvStorage, built from the arguments given
+    upon instantiation. Any other Storage may be given instead of the csv file name.
+
+    If a journal file is given, operations are appended to it instead of
+    rewriting the csv file on every save. The journal is replayed on load,
+    and folded into the csv file by compact().
+
+    If the Storage can read Nodes one at a time, Nodes are not read upon
+    instantiation. Each Node is read only when it is first looked up by name.
+    Operations that need all Nodes, like print_summary(), read the remaining ones.
+
+    Changes made to the Storage by others, such as hand edits of the csv file,
+    are picked up by refresh(), or continuously by watch().
+
+    If a History is given, the operations that undo each operation applied
+    are recorded, grouped by command with checkpoint(), and saved to it along
+    with the operations themselves. undo() applies them.
+
     Exceptions:
         TypeError - When any argument received has invalid type.
                     Most arguments are expected to be strings.
@@ -38,45 +65,260 @@ class TitleManager:
                      Happens when trying to add an alias that already exists, for example.
         IndexError - When trying to access an element not in the list in question."""
     
-    def __init__(self, filename, bkfile=None):
-        # nodes: list of existent nodes
-        # filename: name of file from which to read all nodes
+    # Operations that are recorded in the journal
+    _journaled = ('add_node', 'rm_node', 'add_alias', 'rm_alias',
+                  'set_comment', 'add_comment', 'rm_comment', 'add_item', 'rm_item')
+
+    def __init__(self, filename, bkfile=None, journal=None, journal_limit=1<<20, index=None, history=None):
+        # nodes: list of existent nodes, or of the ones read so far if not 'loaded'
+        # filename: name of file from which to read all nodes, or a Storage
         # bkfile: name of file to which backup all nodes
+        # journal: name of file to which append operations not yet written to 'filename'
+        # index: name of file with offsets of nodes in 'filename', for reading them lazily
+        # storage: Storage from which nodes are read
+        # loaded: whether all nodes were read from 'storage'
+        # pending: records of operations applied since the last save
+        # changes: number of operations applied since the last save
+        # names: maps every normalized title and alias to its node
+        # holders: maps every lowercased item to the list of nodes that contain it
+        # lookup: NameIndex of normalized titles and aliases, or None until the first prefix or similarity lookup
+        # item_lookup: NameIndex of the keys of 'holders', or None until the first similarity lookup of items
+        # timings: Timings of the 'load', 'render' and 'save' phases of this TitleManager
+        # history: History to which save how to undo each command, or None. A file name may be given instead.
+        # inverse: records of the operations that undo the ones applied since the last checkpoint, last
+        #       to be applied first, or None if no history is kept or while operations are replayed
+        # entries: commands checkpointed since the last save, as tuples (time, label, records), oldest first
+        # label: name of the current command, given to the last checkpoint()
+        self.timings = Timings()
         self.nodes = []
-        self.filename = filename
-        self.bkfile = bkfile
-        self.read_from_csv(filename)
+        self.names = {}
+        self.holders = {}
+        self.lookup = None
+        self.item_lookup = None
+        if isinstance(filename, Storage):
+            self.storage = filename
+        else:
+            self.storage = CsvStorage(filename, bkfile, journal, journal_limit, index)
+        self.loaded = False
+        self.pending = []
+        self.changes = 0
+        self.history = History(history) if isinstance(history, str) else history
+        self.inverse = None if self.history is None else []
+        self.entries = []
+        self.label = ''
+        with self.timings.phase('load'):
+            if not self.storage.lazy:
+                self._load_all()
+            self.replay(self.storage.replay())
+            self.refresh() # In case others replaced the Nodes read between reading them and the journal
 
     def close(self):
+        """If the Storage is journaled, saves the operations applied since
+          the last save, compacting it if the Storage asks so.
+        Otherwise saves all nodes, as done by compact().
+        Nothing is written if nothing changed since the last save."""
+        with self.timings.phase('save'):
+            if self.storage.journaled:
+                if not self.pending:
+                    return
+                with self.storage.lock():
+                    full = self.storage.save(self.pending)
+                    self._save_history()
+                self.pending = []
+                self.changes = 0
+                if full:
+                    self.compact()
+            elif self.is_dirty():
+                self.compact()
+
+    def is_dirty(self):
+        """Checks if any node changed since the last save."""
+        return self.changes > 0 or any(node.is_dirty() for node in self.nodes)
+
+    def compact(self):
         """If this TitleManager was given a name for a backup file upon instantiation,
           transfer contents of the old Nodes csv file to this backup.
-        Then saves all nodes in the Nodes csv file, overwriting it."""
-        if self.bkfile:
-            self.write_to_csv(self.filename, self.bkfile)
-        else:
-            self.write_to_csv(self.filename)
+        Then saves all nodes in the Nodes csv file, overwriting it,
+          and empties the journal, if any.
+        Other Storages are likewise overwritten with all nodes.
+        Changes saved by other processes meanwhile are not lost: they are picked
+          up with refresh() under the Storage's lock, and the operations applied
+          here since the last save are applied again after them.
+        Commands checkpointed since the last save are saved to the History."""
+        self._load_all()
+        self.refresh() # Most changes of others are picked up before locking, so the lock is held briefly
+        with self.storage.lock():
+            self.refresh()
+            with self.timings.phase('save'):
+                self.storage.write_all(self.nodes)
+                self._save_history()
+        self.pending = []
+        for node in self.nodes:
+            node.mark_clean()
+        self.changes = 0
+
+    def stats(self):
+        """Returns a dictionary with measurements of this TitleManager:
+            phases - seconds spent in each phase, such as 'load', 'render' and 'save'
+            bytes_read, bytes_written - bytes transferred by the Storage
+            nodes, aliases, items - number of each currently in memory"""
+        return {
+            'phases': self.timings.get(),
+            'bytes_read': self.storage.bytes_read,
+            'bytes_written': self.storage.bytes_written,
+            'nodes': len(self.nodes),
+            'aliases': sum(len(node.get_alias()) for node in self.nodes),
+            'items': sum(len(node.items) for node in self.nodes),
+        }
+
+    def replay(self, records):
+        """Applies the operations in 'records', as written to the journal.
+        Operations that fail are skipped, since the csv file may have been
+          edited by hand after they were recorded."""
+        self._apply(records)
+        self.pending = []
+        self.changes = 0
+
+    def refresh(self):
+        """Picks up changes made to the Storage by others since it was last read
+        or saved, like edits of the csv file or operations saved by another process.
+        Only Nodes whose stored contents changed are read again, along with the
+        ones changed in memory. Operations applied since the last save are then
+        applied again, and are still saved on the next save.
+        Returns:
+            True if anything changed, False otherwise."""
+        def reuse(node):
+            # Nodes removed are not found by title anymore
+            return not node.is_dirty() and self.names.get(self._normalize(node.get_title())) is node
+
+        with self.timings.phase('load'):
+            found = self.storage.refresh(reuse, rescan=bool(self.pending))
+            if found is None:
+                return False
+            nodes, records = found
+            pending, self.pending = self.pending, [] # replay() appends to self.pending
+            if nodes is not None:
+                self._replace_nodes(nodes)
+            self.replay(records)
+            self._apply(pending)
+        return True
+
+    def watch(self, interval=1.0):
+        """Generator that refreshes this TitleManager every 'interval' seconds, forever.
+        Yields after every refresh that changed something."""
+        while True:
+            time.sleep(interval)
+            if self.refresh():
+                yield
+
+    def _apply(self, records):
+        """Applies the operations in 'records', skipping the ones that fail.
+        As they are replayed or undone operations, their inverses are not recorded."""
+        inverse, self.inverse = self.inverse, None
+        try:
+            for record in records:
+                op, args = record[0], list(record[1:])
+                if op not in self._journaled:
+                    continue
+                if op == 'add_comment':
+                    args = [args[0], args[1:]]
+                elif op in ('set_comment', 'rm_comment'):
+                    args[1] = int(args[1])
+                try:
+                    getattr(self, op)(*args)
+                except (ValueError, IndexError, TypeError):
+                    pass
+        finally:
+            self.inverse = inverse
+
+    def checkpoint(self, label=''):
+        """Ends the current command and starts another one, named 'label' in the History.
+        The operations applied between checkpoints are undone together by undo().
+        Commands without operations are not recorded, nor anything if no History is kept."""
+        if self.inverse:
+            self.entries.append((time.time(), self.label, self.inverse[::-1]))
+            self.inverse = []
+        self.label = label
+
+    def undo(self, n=1):
+        """Undoes the last 'n' commands, latest first, and saves the result.
+        Commands checkpointed but not saved yet are the latest ones, followed by
+          the ones in the History, which are removed from it once undone.
+        Operations that cannot be undone anymore, like the ones on Titles removed
+          since, are skipped. Items removed by a command are added back as the
+          latest items of their Titles.
+        Returns:
+            List of pairs (time, label) of the commands undone, latest first.
+        Raises:
+            ValueError - No History is kept."""
+        if self.history is None:
+            raise ValueError
+        n = max(0, n)
+        self.checkpoint(self.label)
+        with self.storage.lock():
+            self.refresh() # Others may have saved commands since
+            undone = self.entries[max(0, len(self.entries) - n):]
+            del self.entries[len(self.entries) - len(undone):]
+            stored = []
+            if len(undone) < n:
+                stored = self.history.read()
+                stored = stored[max(0, len(stored) - (n - len(undone))):]
+            entries = [entry[1:] for entry in stored] + undone
+            for when, label, records in reversed(entries):
+                self._apply(records)
+            self.close()
+            if stored:
+                self.history.truncate(stored[0][0])
+        return [(when, label) for when, label, records in reversed(entries)]
 
-    def print_summary(self):
+    def get_history(self):
+        """Returns the commands that undo() would undo, latest first, as tuples
+          (time, label, number of operations undoing it).
+        Raises:
+            ValueError - No History is kept."""
+        if self.history is None:
+            raise ValueError
+        entries = [entry[1:] for entry in self.history.read()] + self.entries
+        return [(when, label, len(records)) for when, label, records in reversed(entries)]
+
+    def iter_nodes(self, offset=0, limit=None):
+        """Yields all nodes, in the order they are stored,
+        skipping the first 'offset' ones and yielding at most 'limit' of them."""
+        self._load_all()
+        stop = None if limit is None else offset + max(0, limit)
+        yield from islice(self.nodes, offset, stop)
+
+    def print_summary(self, offset=0, limit=None, fmt='text', out=None):
         """Prints all nodes, each one occupying a single line.
-        Information diplayed is only the Node's title and aliases."""
-        for node in self.nodes:
-            node.print_line(40)
+        Information diplayed is only the Node's title and aliases.
+        'offset' and 'limit' select which nodes to print, as in iter_nodes().
+        'fmt' is one of Renderer.formats, and 'out' the stream to print to, sys.stdout by default.
+        Returns the number of nodes printed."""
+        self._load_all()
+        nodes = self.iter_nodes(offset, limit)
+        with self.timings.phase('render'):
+            return Renderer(out, fmt).summary(nodes)
 
-    def print_full(self, string=None, length=-1):
+    def print_full(self, string=None, length=-1, offset=0, limit=None, fmt='text', out=None):
         """Prints all information about nodes.
         If 'string' is given, prints full information about only the node identified by it.
-        If 'string is NOT given, prints information for all nodes.
+        If 'string is NOT given, prints information for all nodes,
+          selected by 'offset' and 'limit' as in iter_nodes().
         If 'length' is given, prints only the latest 'length' items added to the Title.
+        'fmt' is one of Renderer.formats, and 'out' the stream to print to, sys.stdout by default.
+        Returns the number of nodes printed.
         Raises:
             ValueError - 'string' is given, but the node cannot be found."""
         if string is not None:
             node = self._find_node_byName(string)
             if not node:
                 raise ValueError
-            node.print_block(length)
+            nodes = [node]
         else:
-            for node in self.nodes:
-                node.print_block(length)
+            self._load_all()
+            nodes = self.iter_nodes(offset, limit)
+        with self.timings.phase('render'):
+            return Renderer(out, fmt).full(nodes, length)
 
     def add_node(self, title):
         """Adds a node to the list of Nodes.
@@ -88,8 +330,10 @@ class TitleManager:
             raise ValueError
         
         node = TitleNode(title)
-        self.nodes.append(node)
-        self.nodes.sort()
+        bisect.insort(self.nodes, node) # Nodes are kept sorted, so replaying many of these stays cheap
+        self._index_node(node)
+        self._log_inverse(('rm_node', title))
+        self._log('add_node', title)
 
     def rm_node(self, string):
         """Removes the node identified by 'string' from the list of Nodes.
@@ -97,7 +341,15 @@ class TitleManager:
         Raise:
             ValueError - node didn't exist anyway."""
         node = self._find_node_byName(string)
+        if not node:
+            raise ValueError
+        if self.inverse is not None:
+            self._log_inverse(*self._restoring(node))
         self.nodes.remove(node)
+        self._unindex_node(node)
+        for item in node.get_items():
+            self._unindex_item(node, item)
+        self._log('rm_node', node.get_title())
 
     def add_alias(self, string, alias):
         """Adds alias to node identified by 'string'.
@@ -112,6 +364,11 @@ class TitleManager:
         if not node:
             raise ValueError("Could not identify node.")
         node.add_alias(alias)
+        self.names[self._normalize(alias)] = node
+        if self.lookup is not None:
+            self.lookup.add(self._normalize(alias))
+        self._log_inverse(('rm_alias', alias))
+        self._log('add_alias', node.get_title(), alias)
 
     def rm_alias(self, alias):
         """Removes alias from the list of nodes.
@@ -122,6 +379,11 @@ class TitleManager:
             if not node:
                 raise ValueError
             node.rm_alias(alias)
+            self.names.pop(self._normalize(alias), None)
+            if self.lookup is not None:
+                self.lookup.discard(self._normalize(alias))
+            self._log_inverse(('add_alias', node.get_title(), alias))
+            self._log('rm_alias', alias)
         else:
             raise TypeError
 
@@ -139,6 +401,8 @@ class TitleManager:
         comment = node.get_comment()
         temp = comment[n]
         comment[n] = comm
+        self._log_inverse(('set_comment', node.get_title(), n, temp))
+        self._log('set_comment', node.get_title(), n, comm)
         return temp
 
     def add_comment(self, string, comm):
@@ -151,7 +415,10 @@ class TitleManager:
         if not node:
             raise ValueError
         comment = node.get_comment()
+        first = len(comment)
         comment.add(comm)
+        self._log_inverse(*[('rm_comment', node.get_title(), first)] * (len(comment) - first))
+        self._log('add_comment', node.get_title(), *([comm] if isinstance(comm, str) else comm))
 
     def rm_comment(self, string, idx):
         """Removes the idx-th comment of the node identified by 'string'
@@ -162,7 +429,11 @@ class TitleManager:
         node = self._find_node_byName(string)
         if not node:
             raise ValueError
-        return node.get_comment().rm(idx)
+        comments = node.get_comment_list()
+        retval = node.get_comment().rm(idx)
+        self._log_inverse(*self._restoring_comment(node.get_title(), comments, idx))
+        self._log('rm_comment', node.get_title(), idx)
+        return retval
 
     def add_item(self, string, item):
         """Adds a unique item 'item' to the node identified by 'string'.
@@ -177,6 +448,9 @@ class TitleManager:
             node.add_item(item)
         except ValueError:
             raise ValueError("Item already exists in the node.")
+        self._index_item(node, item)
+        self._log_inverse(('rm_item', node.get_title(), item))
+        self._log('add_item', node.get_title(), item)
 
     def rm_item(self, string, item):
         """Removes the item 'item' from the node identified by 'string'.
@@ -186,77 +460,466 @@ class TitleManager:
         node = self._find_node_byName(string)
         if not node:
             raise ValueError("Node could not be identified")
+        stored = node.items.get(item.lower()) if isinstance(item, str) else None
         try:
             node.rm_item(item)
         except ValueError:
             raise ValueError("Node does not have given item.")
+        self._unindex_item(node, item)
+        self._log_inverse(('add_item', node.get_title(), stored))
+        self._log('rm_item', node.get_title(), item)
 
     def find_item(self, item):
         """Returns all Nodes that contain item 'item'.
         Return:
             List with all TitleNode containing the given item."""
-        lnodes = []
-        for node in self.nodes:
-            if node.has_item(item) >= 0:
-                lnodes.append(node)
-        
-        return lnodes
+        if not isinstance(item, str):
+            raise TypeError
+        titles = None if self.loaded else self.storage.holders(item)
+        if titles is None:
+            self._load_all()
+            return sorted(self.holders.get(item.lower(), []))
 
-    def read_from_csv(self, path):
-        """Reads all TitleNodes on a csv file, and store them internally."""
-        if not isinstance(path, str):
+        # Nodes in memory are up to date, and the Storage knows about the remaining ones
+        lnodes = dict((id(node), node) for node in self.holders.get(item.lower(), []))
+        for title in titles:
+            node = self._find_node_byName(title)
+            if node is not None and node.contains_item(item):
+                lnodes[id(node)] = node
+        return sorted(lnodes.values())
+
+    def find_prefix(self, prefix, limit=None):
+        """Finds the nodes with a title or alias starting with 'prefix'.
+        Comparison is done case-insensitive and ignoring leading blank characters.
+        Returns:
+            List of at most 'limit' nodes, ordered by their matching names."""
+        lookup = self._name_lookup()
+        return self._nodes_named(lookup.prefix(self._normalize(prefix)), limit)
+
+    def find_similar(self, string, limit=10):
+        """Finds the nodes with a title or alias similar to 'string', tolerating typos.
+        Returns:
+            List of at most 'limit' nodes, the most similar first."""
+        lookup = self._name_lookup()
+        found = lookup.similar(self._normalize(string), limit * 2)
+        return self._nodes_named((name for _, name in found), limit)
+
+    def find_similar_items(self, item, limit=10):
+        """Finds the items most similar to 'item' among the items of all nodes, tolerating typos.
+        Returns:
+            List of at most 'limit' items, as stored in their nodes, the most similar first."""
+        self._load_all()
+        if self.item_lookup is None:
+            self.item_lookup = NameIndex(self.holders)
+        return [self.holders[key][0].items[key] for _, key in self.item_lookup.similar(item.lower(), limit)]
+
+    def find_items(self, items):
+        """Looks up several items at once.
+        Return:
+            List of pairs (item, nodes), in the order items were given,
+            where 'nodes' is the list returned by find_item(item)."""
+        if not isinstance(items, list) \
+        or False in [isinstance(i, str) for i in items]:
             raise TypeError
+        return [(item, self.find_item(item)) for item in items]
 
-        try:
-            with open(path) as fp:
-                rd = csv.reader(fp)
-                while True:
-                    try:
-                        node = TitleNode().read_from_csv(rd)
-                    except ValueError: break
-                    self.nodes.append(node)
-        except FileNotFoundError:
-            open(path, "w") # May throw another FileNotFoundError, depending on 'path'
+    def combine_items(self, op, strings):
+        """Combines the sets of items of the nodes identified by the list 'strings'.
+        'op' is one of:
+            'union' - Items of any of the nodes.
+            'intersection' - Items of all of the nodes.
+            'difference' - Items of the first node that none of the others has.
+        Items are compared case-insensitively, through the keys of each node's items,
+        so the sets are combined without building any list of items.
+        Returns:
+            List of items, as stored in the first node holding each one, in the order of
+            the nodes given and of addition to them.
+        Raises:
+            ValueError - A node cannot be found, or 'op' is unknown."""
+        nodes = self._nodes_identified(strings)
+        if not nodes:
+            return []
+        if op == 'union':
+            order, merged = {}, {}
+            for node in nodes:
+                order.update(dict.fromkeys(node.items))
+            for node in reversed(nodes):
+                merged.update(node.items)
+            return [merged[key] for key in order]
+
+        first = nodes[0].items
+        if op == 'intersection':
+            keys = first.keys()
+            for node in nodes[1:]:
+                keys = keys & node.items.keys()
+        elif op == 'difference':
+            keys = first.keys() - set().union(*[node.items.keys() for node in nodes[1:]])
+        else:
+            raise ValueError("Unknown operation '{}'".format(op))
+        return [item for key, item in first.items() if key in keys]
+
+    def count_items(self, strings=None):
+        """Counts the items of the nodes identified by the list 'strings', or of all nodes if not given.
+        Returns:
+            List of pairs (node, number of items).
+        Raises:
+            ValueError - A node cannot be found."""
+        if strings is None:
+            self._load_all()
+            nodes = self.nodes
+        else:
+            nodes = self._nodes_identified(strings)
+        return [(node, len(node.items)) for node in nodes]
+
+    def top_nodes(self, n):
+        """Returns pairs (node, number of items) for the 'n' nodes with the most items, most first."""
+        self._load_all()
+        return [(node, len(node.items)) for node in heapq.nlargest(n, self.nodes, key=lambda node: len(node.items))]
+
+    def top_items(self, n):
+        """Returns pairs (item, number of nodes holding it) for the 'n' items held by the most nodes, most first."""
+        self._load_all()
+        top = heapq.nlargest(n, self.holders.items(), key=lambda pair: len(pair[1]))
+        return [(nodes[0].items[key], len(nodes)) for key, nodes in top]
+
+    def import_records(self, records, batch=10000):
+        """Adds the Titles, aliases, items and comments described by 'records', an iterable of
+          tuples (title, alias, item, comment) as read by RecordReader. Empty fields are ignored.
+        Titles are created when no Title or alias is named like them. Aliases, items and
+          comments the Title already has are skipped, as are aliases of other Titles.
+        Records are taken 'batch' at a time, so they can be streamed from a file of any size;
+          Titles created are sorted into place once per batch.
+        If the Storage is journaled, the operations of each batch are saved once it is applied,
+          so that they don't pile up in memory, and the operations undoing them are appended
+          to the History as parts of the current command. The Storage is compacted at the end
+          if the import filled its journal. Otherwise nothing is saved until close().
+        Returns:
+            Dictionary with the number of 'records' read, of 'titles', 'aliases', 'items' and
+            'comments' added, and of records that were 'duplicates' or alias 'conflicts'."""
+        counts = dict.fromkeys(('records', 'titles', 'aliases', 'items', 'comments',
+                                'duplicates', 'conflicts'), 0)
+        records = iter(records)
+        parted = full = False # Whether a part of the command was saved to the History, and the journal filled
+        while True:
+            chunk = list(islice(records, batch))
+            if not chunk:
+                if full:
+                    self.compact()
+                return counts
+            created = False
+            last, node = None, None
+            for name, alias, item, comment in chunk:
+                counts['records'] += 1
+                if name != last: # Records of a Title usually come together
+                    last = name
+                    node = self._find_node_byName(name)
+                    if node is None:
+                        node = TitleNode(name.strip())
+                        self.nodes.append(node)
+                        self._index_node(node)
+                        self._log_inverse(('rm_node', node.get_title()))
+                        self._log('add_node', node.get_title())
+                        counts['titles'] += 1
+                        created = True
+                    title = node.get_title()
+                if alias:
+                    other = self._find_node_byName(alias)
+                    if other is None:
+                        self.add_alias(title, alias)
+                        counts['aliases'] += 1
+                    else:
+                        counts['duplicates' if other is node else 'conflicts'] += 1
+                if item:
+                    if node.contains_item(item):
+                        counts['duplicates'] += 1
+                    else:
+                        node.add_item(item) # As add_item() does, without looking up the node again
+                        self._index_item(node, item)
+                        self._log_inverse(('rm_item', title, item))
+                        self._log('add_item', title, item)
+                        counts['items'] += 1
+                if comment:
+                    if comment in node.get_comment_list():
+                        counts['duplicates'] += 1
+                    else:
+                        self.add_comment(title, comment)
+                        counts['comments'] += 1
+            if created:
+                self.nodes.sort()
+            if self.storage.journaled and self.pending:
+                continued = parted
+                parted = parted or bool(self.inverse)
+                full = self._save_part(continued) or full
+
+    def export_records(self, strings=None):
+        """Returns a generator of tuples (title, alias, item, comment), as taken by import_records(),
+          describing all Titles, or the ones identified by the list 'strings'.
+        Each tuple holds a single alias, comment or item. Titles with none of them get a tuple of their own.
+        Raises:
+            ValueError - A Title cannot be found. Its string is the exception message."""
+        nodes = self.iter_nodes() if strings is None else self._nodes_identified(strings)
+        return self._records(nodes)
+
+    @staticmethod
+    def _records(nodes):
+        """Yields the records describing each node in 'nodes', as export_records() does."""
+        for node in nodes:
+            title = node.get_title()
+            empty = True
+            for alias in node.get_alias():
+                yield (title, alias, '', '')
+                empty = False
+            for comment in node.get_comment_list():
+                yield (title, '', '', comment)
+                empty = False
+            for item in node.items.values():
+                yield (title, '', item, '')
+                empty = False
+            if empty:
+                yield (title, '', '', '')
+
+    def read_from_csv(self, path):
+        """Reads all TitleNodes on a csv file, and store them internally."""
+        for node, fresh in CsvStorage(path).read_all():
+            self._add_read_node(node)
 
     def write_to_csv(self, path, bkpath=None):
         """Writes all TitleNodes to the csv file.
         If 'bkpath' is given, backup the main file before overwriting it."""
-        if not isinstance(path, str):
+        self._load_all()
+        CsvStorage(path, bkpath).write_all(self.nodes)
+
+    def migrate(self, storage):
+        """Writes all TitleNodes to 'storage', replacing whatever it stored."""
+        if not isinstance(storage, Storage):
             raise TypeError
+        self._load_all()
+        storage.write_all(self.nodes)
 
-        # Overwrite original file. Nothing should go wrong, so extra caution is taken.
-        try:
-            with open(path, 'r') as fp:
-                safebuf = fp.read()
-        except:
-            safebuf = None
+    def _log(self, op, *args):
+        """Counts operation 'op' as applied since the last save,
+        recording it to be appended to the journal on the next save."""
+        self.changes += 1
+        self.pending.append([op] + list(args))
 
-        try:
-            with open(path, 'w') as fp:
-                wr = csv.writer(fp)
-                for node in self.nodes:
-                    node.write_to_csv(wr)
-        except:
-            print("FATAL: Exception upon overwriting original CSV file. Attempting to undo overwriting.")
-            if safebuf:
-                with open(path, 'w') as fp:
-                    fp.write(savebuf)
-
-        # Saves the backup
-        if bkpath and safebuf:
-            with open(bkpath, 'w') as outfile:
-                outfile.write(safebuf)
+    def _log_inverse(self, *records):
+        """Records the operations that undo the operation being logged, in the order
+        they must be applied, if a History is kept."""
+        if self.inverse is not None:
+            self.inverse.extend(reversed(records))
+
+    def _save_part(self, continued):
+        """Saves the operations applied since the last save, as close() does, but neither
+        compacting the Storage nor ending the current command. The operations undoing it
+        so far are appended to the History as a part of it, following the part saved
+        before if 'continued'.
+        Returns:
+            True if the Storage asks to be compacted, False otherwise."""
+        with self.timings.phase('save'):
+            with self.storage.lock():
+                full = self.storage.save(self.pending)
+                if self.history is not None:
+                    if self.inverse:
+                        self.entries.append((time.time(), self.label, self.inverse[::-1]))
+                        self.inverse = []
+                    self.history.append(self.entries, continued)
+                    self.entries = []
+            self.pending = []
+            self.changes = 0
+        return full
+
+    def _save_history(self):
+        """Ends the current command and appends the commands checkpointed
+        since the last save to the History, if one is kept."""
+        if self.history is None:
+            return
+        self.checkpoint(self.label)
+        self.history.append(self.entries)
+        self.entries = []
+
+    @staticmethod
+    def _restoring(node):
+        """Returns the records of the operations that create 'node' again, as it is now."""
+        title = node.get_title()
+        records = [('add_node', title)]
+        records.extend(('add_alias', title, alias) for alias in node.get_alias())
+        comments = node.get_comment_list()
+        if comments:
+            records.append(('add_comment', title, *comments))
+        records.extend(('add_item', title, item) for item in node.items.values())
+        return records
+
+    @staticmethod
+    def _restoring_comment(title, comments, idx):
+        """Returns the records of the operations that put back in its place the comment
+        removed from index 'idx' of the list 'comments', of the node titled 'title'.
+        As comments can only be added at the end, the last one is added again,
+        and the ones from 'idx' on are set back to what they were."""
+        idx %= len(comments)
+        records = [('add_comment', title, comments[-1])]
+        records.extend(('set_comment', title, i, comments[i]) for i in range(idx, len(comments) - 1))
+        return records
 
     def _find_node_byName(self, string):
         """Given a string, attemps to find the node with alias or title
         that is equivalent to the string.
         Comparison is done case-insensitive and ignoring blank characters.
         Returns None if no node was found"""
-        string = string.strip().lower()
-        for node in self.nodes:
-            l = []
-            l.append(node.get_title().strip().lower())
-            l.extend([i for i in node.get_alias()]) 
-            if string in l:
-                return node
-        return None
+        key = self._normalize(string)
+        node = self.names.get(key)
+        if node is None and not self.loaded:
+            with self.timings.phase('load'):
+                node = self.storage.read(key)
+            if node is not None:
+                self._add_read_node(node)
+                node = self.names.get(key)
+        return node
+
+    def _name_lookup(self):
+        """Returns the NameIndex of all names, building it if needed.
+        If the Storage knows all names, nodes are not read to build it."""
+        if self.lookup is None:
+            stored = None if self.loaded else self.storage.names()
+            if stored is None:
+                self._load_all()
+                stored = ()
+            # Stored names of nodes removed since are harmless: they aren't found by name anymore
+            self.lookup = NameIndex(self.names.keys() | set(stored))
+        return self.lookup
+
+    def _nodes_named(self, names, limit=None):
+        """Returns the distinct nodes identified by 'names', at most 'limit' of them, skipping unknown names."""
+        found = {}
+        for name in names:
+            if limit is not None and len(found) >= limit:
+                break
+            node = self._find_node_byName(name)
+            if node is not None:
+                found.setdefault(id(node), node)
+        return list(found.values())
+
+    def _nodes_identified(self, strings):
+        """Returns the nodes identified by the list 'strings'.
+        Raises:
+            ValueError - A node cannot be found. Its string is the exception message."""
+        if not isinstance(strings, list) \
+        or False in [isinstance(i, str) for i in strings]:
+            raise TypeError
+        nodes = []
+        for string in strings:
+            node = self._find_node_byName(string)
+            if node is None:
+                raise ValueError(string)
+            nodes.append(node)
+        return nodes
+
+    def _load_all(self):
+        """Reads all nodes not read yet from the Storage.
+        Nodes already in memory are kept as they are, in the order of the Storage.
+        Nodes created or removed in the meantime stay so."""
+        if self.loaded:
+            return
+        kept = set(id(node) for node in self.nodes)
+        stored = set()
+        created = self.nodes
+
+        self.nodes = []
+        with self.timings.phase('load'):
+            for node, fresh in self.storage.read_all():
+                if fresh:
+                    self._add_read_node(node)
+                elif id(node) in kept:
+                    self.nodes.append(node)
+                    stored.add(id(node))
+        created = [node for node in created if id(node) not in stored]
+        self.nodes.extend(created)
+        if created:
+            self.nodes.sort()
+        self.loaded = True
+
+    def _add_read_node(self, node):
+        """Appends a node just read from the Storage to the list of nodes,
+        adding it to the name and item indexes."""
+        self.nodes.append(node)
+        self._index_node(node)
+        holders = self.holders
+        for key in node.items: # Already lowercased and interned
+            nodes = holders.get(key)
+            if nodes is None:
+                holders[key] = [node]
+                if self.item_lookup is not None: # Nodes read again by refresh()
+                    self.item_lookup.add(key)
+            else:
+                nodes.append(node)
+
+    def _replace_nodes(self, nodes):
+        """Replaces all nodes with the pairs (node, fresh) in 'nodes', as returned by Storage.refresh().
+        Nodes not in 'nodes' anymore are removed from the indexes, and fresh ones added."""
+        kept = set(id(node) for node, fresh in nodes if not fresh)
+        gone = [node for node in self.nodes if id(node) not in kept]
+        if len(gone) * 2 > len(self.nodes):
+            # Cheaper to build the indexes again
+            kept = set()
+            self.names = {}
+            self.holders = {}
+            self.lookup = None
+            self.item_lookup = None
+        else:
+            for node in gone:
+                self._unindex_node(node)
+                for item in node.get_items():
+                    self._unindex_item(node, item)
+
+        self.nodes = []
+        for node, fresh in nodes:
+            if id(node) in kept:
+                self.nodes.append(node)
+            else:
+                self._add_read_node(node)
+        self.loaded = True
+
+    # Key under which a string is stored in the name index
+    _normalize = staticmethod(Storage.normalize)
+
+    def _index_node(self, node):
+        """Adds title and aliases of 'node' to the name index.
+        If a name is already taken by another node, the older node keeps it."""
+        for name in [node.get_title()] + node.get_alias():
+            key = self._normalize(name)
+            self.names.setdefault(key, node)
+            if self.lookup is not None:
+                self.lookup.add(key)
+
+    def _unindex_node(self, node):
+        """Removes from the name index every name that points to 'node'."""
+        names = [node.get_title()] + node.get_alias()
+        for key in [self._normalize(i) for i in names]:
+            if self.names.get(key) is node:
+                del self.names[key]
+                if self.lookup is not None:
+                    self.lookup.discard(key)
+
+    def _index_item(self, node, item):
+        """Records that 'node' contains 'item' in the item index."""
+        key = item.lower()
+        holders = self.holders.get(key)
+        if holders is None:
+            self.holders[sys.intern(key)] = [node]
+            if self.item_lookup is not None:
+                self.item_lookup.add(key)
+        else:
+            holders.append(node)
+
+    def _unindex_item(self, node, item):
+        """Removes the record that 'node' contains 'item' from the item index."""
+        key = item.lower()
+        holders = self.holders.get(key, [])
+        # Nodes are compared by identity, since they compare equal by title
+        for i in range(len(holders)):
+            if holders[i] is node:
+                del holders[i]
+                break
+        if not holders:
+            self.holders.pop(key, None)
+            if self.item_lookup is not None:
+                self.item_lookup.discard(key)
@@ -16,11 +16,12 @@
 #
 #    Contact: matheus.saldanha@usp.br
 
-import csv
-import termcolor as tc
+import sys
+from itertools import islice
 
 from .namedEntity import NamedEntity
 from .comment import Comment
+from .colors import colored
 
 class TitleNode(NamedEntity):
     """This class will represent a single Title, and handle Title-specific queries.
@@ -41,15 +42,29 @@ class TitleNode(NamedEntity):
                      forcing the function not to do what its name suggests.
                      Happens when trying to add an alias that already exists, for example."""
 
+    __slots__ = ('comment', 'items')
+
     def __init__(self, title="Null"):
         super(TitleNode, self).__init__(title)
-        self.comment = Comment()
-        self.items = []
+        # comment: Comment object, or None until it is first needed
+        # items: maps each lowercased item to the item as given.
+        #        Insertion order is kept, so the latest items are the last ones.
+        #        Item strings are interned, so that items repeated across Nodes are stored once.
+        self.comment = None
+        self.items = {}
 
     def get_comment(self):
         """Returns the Comment object in this Node."""
+        if self.comment is None:
+            self.comment = Comment()
         return self.comment
 
+    def get_comment_list(self):
+        """Returns a list with all comments of this Node."""
+        if self.comment is None:
+            return []
+        return self.comment.get_list()
+
     def has_item(self, item):
         """Checks if this Node contains 'item'.
         Comparisons between strings are case-insensitive.
@@ -58,12 +73,20 @@ class TitleNode(NamedEntity):
             -1 otherwise."""
         if not isinstance(item, str):
             raise TypeError
-        temp = [i.lower() for i in self.items]
-        if item.lower() in temp:
-            return temp.index(item.lower())
+        if item.lower() in self.items:
+            return list(self.items).index(item.lower())
         else:
             return -1
 
+    def contains_item(self, item):
+        """Checks if this Node contains 'item', without looking for its index like has_item().
+        Comparisons between strings are case-insensitive.
+        Returns:
+            True if the item exists, False otherwise."""
+        if not isinstance(item, str):
+            raise TypeError
+        return item.lower() in self.items
+
     def add_item(self, item):
         """Adds a unique item to this Node.
         Comparisons between strings are not case-sensitive.
@@ -71,9 +94,10 @@ class TitleNode(NamedEntity):
             ValueError - Item already existed"""
         if not isinstance(item, str):
             raise TypeError
-        if self.has_item(item) >= 0:
+        if self.contains_item(item):
             raise ValueError
-        self.items.append(item)
+        self._store_item(item)
+        self.dirty = True
 
     def rm_item(self, item):
         """Removes an item from this Node.
@@ -82,19 +106,37 @@ class TitleNode(NamedEntity):
             ValueError - Item does not exist within this node, thus could not be removed."""
         if not isinstance(item, str):
             raise TypeError
-        idx = self.has_item(item)
-        if idx < 0:
+        if not self.contains_item(item):
             raise ValueError
-        self.items.pop(idx)
+        del self.items[item.lower()]
+        self.dirty = True
+
+    def _store_item(self, item):
+        """Stores 'item', interning it and its lowercased key."""
+        key = sys.intern(item.lower())
+        self.items[key] = key if key == item else sys.intern(item)
 
     def get_items(self, howmany=-1):
         """Returns a list with the last 'howmany' items added to this Node.
         If 'howmany' is negative, returns all items.
         If 'howmany' is higher than the number of items, returns all of them."""
         if howmany < 0:
-            return [i for i in self.items]
+            return list(self.items.values())
         else:
-            return [i for i in self.items[-howmany:]]
+            latest = list(islice(reversed(self.items.values()), howmany))
+            latest.reverse()
+            return latest
+
+    def is_dirty(self):
+        """Checks if this Node, including its comments, changed since the last
+        call to mark_clean()."""
+        return self.dirty or (self.comment is not None and self.comment.is_dirty())
+
+    def mark_clean(self):
+        """Marks the current state of this Node, including its comments, as saved."""
+        self.dirty = False
+        if self.comment is not None:
+            self.comment.mark_clean()
 
     def write_to_csv(self, writer):
         """Appends this Node to the csv file.
@@ -104,7 +146,7 @@ class TitleNode(NamedEntity):
             [item1],[item2],..."""
         title_row = [self.get_title(),]
         title_row.extend(self.get_alias())
-        writer.writerows([title_row, self.comment.get_list(), self.items])
+        writer.writerows([title_row, self.get_comment_list(), self.get_items()])
 
     def read_from_csv(self, reader):
         """Reads a Node from a csv file, overwriting the current Node instance.
@@ -114,51 +156,74 @@ class TitleNode(NamedEntity):
         try:
             l = next(reader)
             self.set_title(l[0])
-            for i in range(1, len(l)):
-                self.alias.add(l[i])
+            self.alias = set(l[1:]) if len(l) > 1 else None
 
             l = next(reader)
             if l:
-                self.comment.add(l)
+                self.get_comment().add(l)
             
             l = next(reader)
-            self.items = [i for i in l]
+            self.items = {}
+            for i in l:
+                if not self.contains_item(i):
+                    self._store_item(i)
+            self.mark_clean()
             return self
         except StopIteration:
             raise ValueError
 
+    def read_parsed(self, names, comments, items):
+        """Fills this Node with rows parsed elsewhere, overwriting it as read_from_csv() does.
+        'names' and 'comments' are the first two rows, and 'items' maps each
+        lowercased item of the third row to the item as read, in the order read.
+        Returns self."""
+        self.set_title(names[0])
+        self.alias = set(names[1:]) if len(names) > 1 else None
+        if comments:
+            self.get_comment().add(comments)
+        self.items = dict(zip(map(sys.intern, items), map(sys.intern, items.values())))
+        self.mark_clean()
+        return self
+
     def print_line(self, width=0):
         """Prints a TitleNode in a line, with colors.
         TitleNode's title will span 'width' characters.
         Intentionally not implemented as __str__"""
-        if not isinstance(width, int):
-            raise TypeError
-        
-        print("{name} ({alias})".format(
-                name=tc.colored(self.get_title().center(width), 'cyan', attrs=['bold', 'dark']),
-                alias=tc.colored(','.join(self.get_alias()), color='yellow')
-            )
-        )
+        print(self.format_line(width))
 
     def print_block(self, length=-1):
         """Prints a TitleNode as a block, with all information desired.
         Only latest 'length' items will be printed, if it's given.
         If it's not given, will print all items."""
-        title = self.get_title()
-        alias = self.get_alias()
-        comm = self.get_comment()
-        items = self.get_items(length)
+        print(self.format_block(length))
 
-        print(tc.colored("{}".format(title), 'magenta', attrs=['bold']))
+    def format_line(self, width=0, color=True):
+        """Returns the line printed by print_line(), without the line break.
+        Colors are left out if 'color' is False."""
+        if not isinstance(width, int):
+            raise TypeError
+
+        name = self.get_title().center(width)
+        alias = ','.join(self.get_alias())
+        if color:
+            name = colored(name, 'cyan', attrs=['bold', 'dark'])
+            alias = colored(alias, color='yellow')
+        return "{} ({})".format(name, alias)
+
+    def format_block(self, length=-1, color=True):
+        """Returns the lines printed by print_block(), without the last line break.
+        Colors are left out if 'color' is False."""
+        paint = colored if color else lambda text, color=None, attrs=None: text
+        items = self.get_items(length)
 
-        i = 0
-        for c in comm.get_list():
-            print(tc.colored("\t[{}] - '{}'".format(i, c), 'yellow'))
-            i = i + 1
-        if i == 0:
-            print(tc.colored("Empty", 'yellow'))
+        lines = [paint(self.get_title(), 'magenta', attrs=['bold'])]
+        for i, c in enumerate(self.get_comment_list()):
+            lines.append(paint("\t[{}] - '{}'".format(i, c), 'yellow'))
+        if len(lines) == 1:
+            lines.append(paint("Empty", 'yellow'))
 
         if len(items) == 0:
-            print(tc.colored("Empty", attrs=['bold']))
+            lines.append(paint("Empty", attrs=['bold']))
         else:
-            print(tc.colored(', '.join([ str(i) for i in items]), attrs=['bold']))
+            lines.append(paint(', '.join([ str(i) for i in items]), attrs=['bold']))
+        return '\n'.join(lines)
@@ -0,0 +1,169 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import codecs
+import json
+import os
+import select
+import signal
+import socket
+import time
+
+class TitleServer:
+    """Class that keeps a TitleManager in memory, serving requests received
+    through a Unix domain socket.
+
+    Each request is a single line holding a JSON object, and the answer is
+    the text the request produced, after which the connection is closed.
+    Requests are handled one at a time, so operations never overlap.
+    Before each request, changes made to the database by others, such as
+    hand edits of the csv file, are picked up with TitleManager.refresh().
+    Clients taking longer than 'timeout' seconds to send their request, or
+    to take its answer, are dropped, so that they can't hold up the others.
+
+    The TitleManager is saved once 'flush_after' operations were applied,
+    or 'flush_interval' seconds after the first unsaved operation,
+    whichever comes first. It is also saved when the server stops.
+
+    Exceptions:
+        OSError - When the socket cannot be created.
+    """
+
+    # Seconds a client may take to send its request, and to take its answer
+    timeout = 10.0
+
+    def __init__(self, tm, address, flush_interval=5.0, flush_after=100):
+        # tm: TitleManager being served
+        # address: path of the Unix domain socket
+        # sock: listening socket, once listen() is called
+        # since: time of the first operation not saved yet, or None
+        self.tm = tm
+        self.address = address
+        self.flush_interval = flush_interval
+        self.flush_after = flush_after
+        self.sock = None
+        self.since = None
+
+    @staticmethod
+    def connect(address):
+        """Connects to the server listening on 'address'.
+        Returns:
+            The connected socket, or None if no server is running."""
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(address)
+        except OSError:
+            conn.close()
+            return None
+        return conn
+
+    @staticmethod
+    def send(conn, request):
+        """Sends the dictionary 'request' through the connection 'conn'.
+        Yields the answer of the server, in chunks of text, until it closes the connection."""
+        conn.sendall((json.dumps(request) + '\n').encode())
+        # Characters may be split across chunks, so they are decoded as a stream
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            data = conn.recv(1 << 16)
+            text = decoder.decode(data, final=not data)
+            if text:
+                yield text
+            if not data:
+                return
+
+    def listen(self):
+        """Starts listening on the socket address.
+        Raises:
+            ValueError - Another server is already listening on the address."""
+        conn = self.connect(self.address)
+        if conn:
+            conn.close()
+            raise ValueError("Server already running.")
+        if os.path.exists(self.address):
+            os.remove(self.address) # Left behind by a server that died
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.address)
+        self.sock.listen()
+
+    def serve(self, handler):
+        """Serves requests until SIGINT or SIGTERM is received, listening first if needed.
+        'handler' is called with each request and the TitleManager,
+          and must return the text to answer with.
+        Raises:
+            ValueError - Another server is already listening on the address."""
+        if not self.sock:
+            self.listen()
+        sock = self.sock
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            while True:
+                timeout = None
+                if self.since is not None:
+                    timeout = max(0, self.since + self.flush_interval - time.monotonic())
+                ready, _, _ = select.select([sock], [], [], timeout)
+                if ready:
+                    conn, _ = sock.accept()
+                    self.tm.refresh()
+                    with conn:
+                        self._handle(conn, handler)
+                if self.since is not None \
+                and (self.tm.changes >= self.flush_after
+                     or time.monotonic() >= self.since + self.flush_interval):
+                    self.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+            self.sock = None
+            os.remove(self.address)
+            self.flush()
+
+    def flush(self):
+        """Saves the TitleManager, if anything changed since it was last saved."""
+        self.tm.close()
+        self.since = None
+
+    def _handle(self, conn, handler):
+        """Reads a request from 'conn', answering it through 'handler'.
+        Requests that don't arrive whole within 'timeout' seconds are ignored."""
+        deadline = time.monotonic() + self.timeout
+        buf = b''
+        while not buf.endswith(b'\n'):
+            try:
+                conn.settimeout(max(0.001, deadline - time.monotonic()))
+                data = conn.recv(1 << 16)
+            except OSError:
+                return # Timed out, or the client went away
+            if not data:
+                return
+            buf += data
+        try:
+            request = json.loads(buf.decode())
+        except ValueError:
+            return
+
+        answer = handler(request, self.tm)
+        try:
+            conn.settimeout(self.timeout)
+            conn.sendall(answer.encode())
+        except OSError:
+            pass # Client went away or stalled, but the operation was applied anyway
+        if self.tm.changes and self.since is None:
+            self.since = time.monotonic()
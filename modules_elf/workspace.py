@@ -0,0 +1,135 @@
+#    ElfTAI specific CSV file manager.
+#    Copyright (C) 2017 Matheus Henrique Junqueira Saldanha
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    Contact: matheus.saldanha@usp.br
+
+import csv
+import io
+import os
+
+from .titleManager import TitleManager
+from .renderer import Renderer
+
+class Workspace:
+    """Class for managing a registry of databases, each one a directory
+    holding the files of one elftai database. The registry is a csv file
+    in which each row is:
+        [name],[directory]
+
+    Queries over many databases run in a pool of processes, one database
+    per process, so they take about as long as the slowest database.
+
+    Exceptions:
+        TypeError - When any argument received has invalid type.
+        ValueError - When a name is registered twice, or isn't registered.
+    """
+
+    def __init__(self, filename):
+        # filename: name of the registry file
+        if not isinstance(filename, str):
+            raise TypeError
+        self.filename = filename
+
+    def read(self):
+        """Returns a dictionary mapping the name of each database to its directory,
+        in the order they were registered."""
+        try:
+            with open(self.filename, newline='') as fp:
+                return {row[0]: row[1] for row in csv.reader(fp) if len(row) >= 2}
+        except FileNotFoundError:
+            return {}
+
+    def get(self, name):
+        """Returns the directory of database 'name', or None if it isn't registered."""
+        return self.read().get(name)
+
+    def add(self, name, directory):
+        """Registers the database in 'directory' under 'name'.
+        Raises:
+            ValueError - 'name' is already registered, or 'directory' doesn't exist."""
+        if not isinstance(name, str) or not isinstance(directory, str):
+            raise TypeError
+        dbs = self.read()
+        if name in dbs or not os.path.isdir(directory):
+            raise ValueError
+        dbs[name] = os.path.abspath(directory)
+        self._write(dbs)
+
+    def rm(self, name):
+        """Unregisters database 'name'. The database itself is kept.
+        Raises:
+            ValueError - 'name' isn't registered."""
+        dbs = self.read()
+        if name not in dbs:
+            raise ValueError
+        del dbs[name]
+        self._write(dbs)
+
+    @staticmethod
+    def query(storages, func, *args, processes=None):
+        """Calls func(tm, name, *args) with the TitleManager and name of each database, in a pool of processes.
+        'storages' is a list of pairs (name, factory), where factory() returns
+          the Storage of the database. 'func' and the factories must be picklable,
+          e.g. functions of a module and functools.partial(CsvStorage, ...).
+        Yields pairs (name, result) in the order of 'storages', where 'result'
+        is what func returned, or the exception it raised."""
+        if len(storages) <= 1:
+            for name, factory in storages:
+                try:
+                    yield name, _run(name, factory, func, args)
+                except Exception as e:
+                    yield name, e
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(processes or min(len(storages), os.cpu_count() or 1)) as pool:
+            futures = [(name, pool.submit(_run, name, factory, func, args)) for name, factory in storages]
+            for name, future in futures:
+                try:
+                    yield name, future.result()
+                except Exception as e:
+                    yield name, e
+
+    def _write(self, dbs):
+        with open(self.filename, 'w', newline='') as fp:
+            csv.writer(fp).writerows(dbs.items())
+
+def _run(name, factory, func, args):
+    """Runs a query of Workspace.query() on a single database."""
+    return func(TitleManager(factory()), name, *args)
+
+def find_lines(tm, name, items, color):
+    """Query for Workspace.query() that looks up several items, as TitleManager.find_items().
+    Returns:
+        List of pairs (item, lines), where 'lines' has the line of each Node
+        holding 'item', as formatted by TitleNode.format_line()."""
+    return [(item, [node.format_line(0, color) for node in nodes])
+            for item, nodes in tm.find_items(items)]
+
+def render_list(tm, name, title, length, offset, limit, fmt, labeled):
+    """Query for Workspace.query() that renders what 'elftai list' prints, with Renderer.
+    If 'labeled' is True, records are labeled with the name of the database.
+    Returns:
+        The rendered text, empty if 'title' is given but not found."""
+    out = io.StringIO()
+    renderer = Renderer(out, fmt, label=name if labeled else None)
+    if title is not None:
+        node = tm._find_node_byName(title)
+        if node:
+            renderer.full([node], length)
+    else:
+        renderer.summary(tm.iter_nodes(offset, limit))
+    return out.getvalue()